@@ -24,10 +24,14 @@ if not hasattr(sys, '_called_from_test'):
     parser.add_argument("-mc", "--max-conns", required=False, type=int, help="Maximum connections")
     parser.add_argument("-tf", "--tokens-file", required=False, type=str, help="File that stores tokens allowed to connect (one in each line). The middleware alters this file when new tokens are authenticated")
     parser.add_argument("-mph", "--master-password-hash", required=False, type=str, help="Hash of the master password that can be used to create new authentication tokens")
+    parser.add_argument("-sb", "--select-backend", required=False, type=str, help="Event backend used to wait on sockets and serial ports (auto, epoll, kqueue, devpoll, poll or select)")
+    parser.add_argument("-aio", "--asyncio", required=False, action='store_true', help="Run the core on an asyncio event loop")
     cmd_args = parser.parse_args()
 
     if cmd_args.verbozity: config.GENERAL_CONFIG.LOG_VERBOZITY = cmd_args.verbozity
     if cmd_args.regex: config.GENERAL_CONFIG.LOG_REGEX = re.compile(cmd_args.regex)
+    if cmd_args.select_backend: config.GENERAL_CONFIG.SELECT_BACKEND = cmd_args.select_backend
+    if cmd_args.asyncio: config.GENERAL_CONFIG.USE_ASYNCIO = True
     if cmd_args.blueprint: config.GENERAL_CONFIG.BLUEPRINT_FILENAME = cmd_args.blueprint
     if cmd_args.address: config.CONTROLLERS_CONFIG.SOCKET_SERVER_BIND_IP = cmd_args.address
     if cmd_args.port: config.CONTROLLERS_CONFIG.SOCKET_SERVER_BIND_PORT = cmd_args.port
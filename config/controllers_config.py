@@ -6,8 +6,20 @@ class CONTROLLERS_CONFIG:
     SOCKET_SERVER_SSL_BIND_PORT = 4568
     SOCKET_SERVER_MAX_CONNECTIONS = 20
     SOCKET_SERVER_RECONNECT_TIMEOUT = 2.0
+    UPDATE_BATCH_INTERVAL = 0.02 # Thing changes are batched into one frame per controller for up to 20ms
+    UPDATE_BATCH_MAX_THINGS = 64 # ... or until that many Things are waiting to be sent
+    SEND_BUFFER_HIGH_WATERMARK = 256 * 1024 # stop sending Thing changes to a controller with that many unsent bytes...
+    SEND_BUFFER_LOW_WATERMARK = 64 * 1024 # ... until its unsent bytes go below that
+    SLOW_CONSUMER_TIMEOUT = 30.0 # disconnect controllers that stay above the high watermark for 30 seconds
+    COMPRESSION_LEVEL = 6 # zlib level of connections that negotiate compression
+    COMMANDS_PER_TICK = 32 # commands handled per connection per tick (the rest wait for the next tick)
+    MAX_QUEUED_COMMANDS = 1024 # stop reading from a connection that has that many commands waiting
+    TLS_HANDSHAKE_TIMEOUT = 10.0 # drop TLS clients that did not finish their handshake in 10 seconds
+    MAX_PENDING_HANDSHAKES = 10 # reject TLS connections while that many handshakes are in progress
     SOCKET_HOSTING_INTERCACES = ["eth0", "eth1", "wlan0", "wlan1", "en0", "en1"]
     SSL_KEY_FILE = ''
     SSL_CERT_FILE = ''
     ALLOWED_TOKENS_FILE = ''
+    TOKENS_JOURNAL_FLUSH_INTERVAL = 0.5 # registered tokens are written to the tokens file (with one fsync) every 0.5 seconds at most
+    TOKENS_JOURNAL_MAX_STALE_LINES = 1000 # rewrite the tokens file once that many of its lines are replaced by later ones
     MASTER_PASSWORD_HASH = 'f7988cdced121be2108ff37c1b79be073e2041a87067995b761f3be22af340dd' # password is yahyas favorite song
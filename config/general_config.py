@@ -11,4 +11,9 @@ class GENERAL_CONFIG:
     LOG_MAX_FILESIZE = 1024*1024
 
     SELECT_TIMEOUT = 1 # 1 second
+    SELECT_BACKEND = "auto" # one of "auto", "epoll", "kqueue", "devpoll", "poll" or "select"
+    USE_ASYNCIO = False # run the core on an asyncio event loop
+    LOOP_STATS_INTERVAL = 60 # report idle-vs-busy statistics of the core loop every 60 seconds
+    PROFILING = True # time the phases of the core loop and the Things (see core/profiler.py)
+    STATE_CHANGE_LOG_SIZE = 4096 # number of recent Thing changes kept so that reconnecting controllers can resume
 
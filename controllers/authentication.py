@@ -1,5 +1,6 @@
 from logs import Log
 from config.controllers_config import CONTROLLERS_CONFIG
+from controllers.token_journal import TokenJournal
 
 import os
 import json
@@ -30,21 +31,22 @@ USER.Anonymous = USER()
 
 class ControllerAuthentication:
     ALLOWED_TOKENS = None
+    JOURNAL = None # TokenJournal of the allowed tokens file (None if there is no file)
 
     @staticmethod
     def initialize():
         if not os.path.isfile(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE) and len(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE) > 0:
             try:
-                with open(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE, "w") as F:
-                    F.write("{}")
+                open(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE, "w").close()
             except: pass
 
         if os.path.isfile(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE):
-            with open(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE, "r") as F:
-                content = json.load(F)
+            ControllerAuthentication.JOURNAL = TokenJournal(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE)
+            content = ControllerAuthentication.JOURNAL.load()
             ControllerAuthentication.ALLOWED_TOKENS = {}
             for user in content.values():
                 ControllerAuthentication.ALLOWED_TOKENS[user["token"]] = USER(**user)
+            ControllerAuthentication.JOURNAL.start()
             Log.info("Loaded allowed tokens from {}".format(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE))
         else:
             Log.warning("All connections will be authenticated automatically (no tokens file provided)")
@@ -80,10 +82,18 @@ class ControllerAuthentication:
         except:
             return False
 
+    # Allows a new user to connect (the user is saved to the tokens file in the background)
+    # user  USER to register
     @staticmethod
     def register_user(user):
         ControllerAuthentication.ALLOWED_TOKENS[user.token] = user
-        if os.path.isfile(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE):
-            with open(CONTROLLERS_CONFIG.ALLOWED_TOKENS_FILE, "w") as F:
-                json.dump(dict(map(lambda u: (u.token, json.loads(str(u))), ControllerAuthentication.ALLOWED_TOKENS.values())), F)
+        if ControllerAuthentication.JOURNAL != None:
+            ControllerAuthentication.JOURNAL.append(json.loads(str(user)))
+
+    # Saves the registered users that are not saved yet
+    @staticmethod
+    def cleanup():
+        if ControllerAuthentication.JOURNAL != None:
+            ControllerAuthentication.JOURNAL.stop()
+            ControllerAuthentication.JOURNAL = None
 
@@ -12,5 +12,10 @@ class ConnectionManager(object):
     def update(self, cur_time_s):
         pass
 
+    # cur_time_s  Current time in seconds
+    # returns     Time at which this manager needs to be updated regardless of I/O, None if never
+    def get_next_update_time(self, cur_time_s):
+        return None
+
     def cleanup(self):
         pass
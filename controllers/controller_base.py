@@ -1,19 +1,56 @@
 from core.select_service import Selectible
+from config.controllers_config import CONTROLLERS_CONFIG
 from logs import Log
 
+from collections import deque
+
+#
+# Encoded Thing states shared by all the controllers, so that a changed state
+# is encoded once per tick no matter how many controllers it is sent to
+#
+class StateFragmentCache(object):
+    def __init__(self):
+        self.fragments = {} # (encoding name, Thing id, state version) -> encoded state
+
+    # encoding  Name of the encoding of the fragment
+    # thing_id  ID of the Thing
+    # version   Version of the Thing's state
+    # encode    Function that encodes the state (called if the fragment is not cached)
+    # returns   The encoded state
+    def get(self, encoding, thing_id, version, encode):
+        key = (encoding, thing_id, version)
+        fragment = self.fragments.get(key, None)
+        if fragment == None:
+            fragment = self.fragments[key] = encode()
+        return fragment
+
+    # Drops all the fragments (called once per tick)
+    def clear(self):
+        self.fragments = {}
+
 class Controller(Selectible):
     def __init__(self, controllers_manager, origin_name):
         self.manager = controllers_manager
         self.origin_name = origin_name
         self.authenticated_user = None
-        self.manager.register_controller(self)
-        self.cache = {} # thing_id -> thing state
-        self.things_listening = [] # a list of things this Controller listens to (None means all)
-        self.things_listening = None # set to [] then to None to fool the linter
+        self.state_bus = self.manager.core.state_bus
+        self.pending_things = set(self.state_bus.get_thing_ids()) # IDs of Things that might need to be sent
+        self.state_bus.subscribe(self.on_things_changed)
+        self.sent_versions = {} # thing_id -> version of the Thing's state last sent to this controller
+        self.resumable = False # whether or not to send resume tokens with the states
+        self.batch_start_time = None # time at which the oldest unsent change was queued (None if nothing is queued)
+        self.backpressure_start_time = None # time at which the unsent bytes went above the high watermark (None if below)
+        self.queued_commands = deque() # received commands waiting for their turn (see ControllersManager.handle_commands)
+        self.num_deferrals = 0 # number of ticks that ended with commands still queued
+        self.things_listening = set() # a set of things this Controller listens to (None means all)
+        self.things_listening = None # set to set() then to None to fool the linter
         Log.info("Controller connected: {}".format(str(self)))
+        self.manager.register_controller(self) # last, it destroys the controller if its origin is at the limit
 
     def destroy_selectible(self):
+        self.queued_commands.clear()
         super(Controller, self).destroy_selectible()
+        self.state_bus.unsubscribe(self.on_things_changed)
         self.manager.deregister_controller(self)
         Log.info("Controller disconnected: {}".format(str(self)))
 
@@ -22,47 +59,164 @@ class Controller(Selectible):
         if not self.authenticated_user:
             return True
 
+        # while a slow controller has too many unsent bytes, its Thing changes stay queued
+        # (so only the latest state of each Thing is sent once it catches up)
+        pending_write_size = self.get_pending_write_size()
+        if self.backpressure_start_time != None:
+            if pending_write_size <= CONTROLLERS_CONFIG.SEND_BUFFER_LOW_WATERMARK:
+                self.backpressure_start_time = None
+            elif cur_time_s >= self.backpressure_start_time + CONTROLLERS_CONFIG.SLOW_CONSUMER_TIMEOUT:
+                Log.warning("Controller {} is not receiving ({} bytes unsent), disconnecting".format(str(self), pending_write_size))
+                return False
+            else:
+                return True
+        elif pending_write_size >= CONTROLLERS_CONFIG.SEND_BUFFER_HIGH_WATERMARK:
+            Log.debug("Controller {} is too slow ({} bytes unsent), holding its updates".format(str(self), pending_write_size))
+            self.backpressure_start_time = cur_time_s
+            return True
+
+        if len(self.pending_things) == 0:
+            return True
+
+        # wait for more changes to send them all in one frame
+        if self.batch_start_time == None:
+            self.batch_start_time = cur_time_s
+        if cur_time_s < self.batch_start_time + CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL and \
+                len(self.pending_things) < CONTROLLERS_CONFIG.UPDATE_BATCH_MAX_THINGS:
+            return True
+        self.batch_start_time = None
+
         try:
-            my_things = self.manager.core.blueprint.get_things()
-            if self.things_listening != None:
-                my_things = filter(lambda t: t.id in self.things_listening, my_things)
+            pending_things = self.pending_things
+            self.pending_things = set()
 
-            big_update = {}
-            for thing in my_things:
-                state = thing.get_state()
-                state["token"] = thing.last_change_token
-                if not thing.id in self.cache or self.cache[thing.id] != state: # @TODO: FIX EQUALITY?
-                    big_update[thing.id] = state
-                    big_update[thing.id]["token"] = thing.last_change_token
+            things_to_send = []
+            for thing_id in pending_things:
+                if self.things_listening != None and thing_id not in self.things_listening:
+                    continue
+                version = self.state_bus.get_version(thing_id)
+                if version != None and self.sent_versions.get(thing_id, None) != version:
+                    things_to_send.append(thing_id)
 
-            if big_update != {}:
-                self.send_data(big_update)
+            if len(things_to_send) > 0:
+                self.send_states(things_to_send)
 
         except:
             Log.error("Controller::update() Failed", exception=True)
             return False
         return True
 
+    # returns  Time at which the batched changes need to be sent (or at which a slow controller
+    #          needs to be disconnected), None if nothing is batched
+    def get_next_flush_time(self):
+        if not self.authenticated_user:
+            return None
+        if self.backpressure_start_time != None:
+            return self.backpressure_start_time + CONTROLLERS_CONFIG.SLOW_CONSUMER_TIMEOUT
+        if self.batch_start_time == None:
+            return None
+        return self.batch_start_time + CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL
+
+    # returns  Statistics of this controller's connection
+    def get_stats(self):
+        return {
+            "buffered_bytes": self.get_pending_write_size(),
+            "pending_things": len(self.pending_things),
+            "backpressure": self.backpressure_start_time != None,
+            "queued_commands": len(self.queued_commands),
+            "deferrals": self.num_deferrals,
+        }
+
     # Sends a JSON object to the controller
     # json_data  JSON data to send to the controller
-    # cache      Whether or not to cache this data
-    def send_data(self, json_data, cache=True):
-        if cache:
-            self.cache.update(json_data) # update the cache
+    def send_data(self, json_data):
         return True
 
+    # Switches the encoding of the messages exchanged with the controller and
+    # replies (in the previous encoding) with the encoding in use
+    # protocol  Name of the requested encoding (see ControllersManager.encodings)
+    def set_protocol(self, protocol):
+        self.send_data({"protocol": "json"}) # only JSON is supported by default
+
+    # Enables compression of the messages sent to the controller and replies
+    # (uncompressed) with the compression in use
+    # compression  Name of the requested compression
+    def set_compression(self, compression):
+        self.send_data({"compression": "none"}) # no compression by default
+
+    # Sends the blueprint view (config and Thing states) to the controller
+    # with_config  Whether or not to include the config (otherwise only its "etag" is included)
+    def send_controller_view(self, with_config=True):
+        view = self.manager.core.blueprint.get_controller_view()
+        if not with_config:
+            view["etag"] = view.pop("config")["etag"]
+        self.send_data(view)
+
+    # Sends the published states of Things to the controller
+    # thing_ids  IDs of the Things to send
+    def send_states(self, thing_ids):
+        for thing_id in thing_ids:
+            self.sent_versions[thing_id] = self.state_bus.get_version(thing_id)
+        return self.write_states(thing_ids, self.state_bus.get_resume_token() if self.resumable else None)
+
+    # Can be implemented to send published states more efficiently than send_data
+    # (e.g. using the manager's shared StateFragmentCache)
+    # thing_ids     IDs of the Things to send
+    # resume_token  Resume token to send with the states as "resume-token" (None to not send it)
+    def write_states(self, thing_ids, resume_token=None):
+        data = dict(map(lambda thing_id: (thing_id, self.state_bus.get_state(thing_id)), thing_ids))
+        if resume_token != None:
+            data["resume-token"] = resume_token
+        return self.send_data(data)
+
+    # Resumes the session of a controller that reconnected: only the Things that changed
+    # since the token was handed out are sent (everything is sent if the token is too old).
+    # Resume tokens are sent with the states from then on
+    # resume_token  The last resume token received by the controller ("" if none)
+    def resume_session(self, resume_token):
+        self.resumable = True
+        changed = self.state_bus.get_changes_since(resume_token) if type(resume_token) is str else None
+        if changed != None:
+            for thing_id in self.state_bus.get_thing_ids():
+                if thing_id not in changed:
+                    self.sent_versions[thing_id] = self.state_bus.get_version(thing_id)
+            self.pending_things.update(changed)
+
+    # Only listen to updates from the given Things
+    # thing_ids  IDs of the Things to listen to
+    def set_things_listening(self, thing_ids):
+        self.things_listening = set(thing_ids)
+        self.state_bus.subscribe(self.on_things_changed, thing_ids=self.things_listening)
+        self.pending_things.update(self.things_listening) # send the ones it didn't receive yet
+
+    # Called by the state bus when Things change their state
+    # thing_ids  IDs of the Things that changed
+    def on_things_changed(self, thing_ids):
+        self.pending_things.update(thing_ids)
+
+    # Queues a command received from the controller until the manager handles it
+    # command  JSON command sent by the controller
+    def queue_command(self, command):
+        self.queued_commands.append(command)
+
+    # Handles the oldest queued command
+    def handle_queued_command(self):
+        self.on_command(self.queued_commands.popleft())
+
     # Called when the controller sends a command
     # command  JSON command sent by the controller
     def on_command(self, command):
         self.manager.on_command(self, command)
 
-    # Invalidates the cache
+    # Invalidates the cache (forgets what was sent so that it gets sent again)
     # thing_id  ID of the thing to invalidate its cache entry. If None then all cache is cleared
     def invalidate_cache(self, thing_id=None):
         if thing_id == None: # invalidate entire cache
-            self.cache = {}
+            self.sent_versions = {}
+            self.pending_things.update(self.state_bus.get_thing_ids())
         else:
-            if thing_id in self.cache:
-                del self.cache[thing_id]
+            if thing_id in self.sent_versions:
+                del self.sent_versions[thing_id]
+            self.pending_things.add(thing_id)
 
 
@@ -0,0 +1,270 @@
+import json
+import struct
+
+#
+# Encoding of the messages exchanged with controllers (the payloads of the
+# length-prefixed frames). Controllers start with JSONEncoding and can
+# negotiate a different one in their authentication object (see README.md)
+#
+class JSONEncoding(object):
+    name = "json"
+    MAP_SEPARATOR = b", " # between the members of an encoded map
+    MAP_END = b"}"
+
+    # obj      JSON-serializable object
+    # returns  The encoded object
+    def encode(self, obj):
+        return json.dumps(obj).encode("utf-8")
+
+    # data     Encoded object
+    # returns  The decoded object
+    def decode(self, data):
+        obj = json.loads(data.decode("utf-8"))
+        if type(obj) is str: # some clients send JSON-encoded JSON strings
+            obj = json.loads(obj)
+        return obj
+
+    # key      Key of the map member
+    # value    Value of the map member
+    # returns  The encoded member, can be spliced into a map with encode_map
+    def encode_member(self, key, value):
+        return (json.dumps(key) + ": " + json.dumps(value)).encode("utf-8")
+
+    # members  List of members encoded with encode_member
+    # returns  The encoded map (same as encoding the dictionary directly)
+    def encode_map(self, members):
+        return self.encode_map_start(len(members)) + self.MAP_SEPARATOR.join(members) + self.MAP_END
+
+    # num_members  Number of members of the map
+    # returns      The beginning of an encoded map, followed by the members (separated by
+    #              MAP_SEPARATOR) and MAP_END
+    def encode_map_start(self, num_members):
+        return b"{"
+
+    # returns  Parameters the controller needs to use this encoding
+    def get_parameters(self):
+        return {}
+
+#
+# Compact MessagePack-style binary encoding. Strings that are in the symbol
+# table (Thing ids and state keys from the blueprint) are interned as small
+# integers using the MessagePack extension type SYMBOL_TYPE (fixext1 for
+# indices below 256, fixext2 otherwise)
+#
+class BinaryEncoding(object):
+    name = "binary"
+    MAP_SEPARATOR = b""
+    MAP_END = b""
+
+    SYMBOL_TYPE = 1
+
+    # symbols  List of strings to intern
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.encoded_symbols = {} # symbol -> its encoding
+        for i in range(min(len(self.symbols), 0x10000)):
+            if i < 0x100:
+                self.encoded_symbols[self.symbols[i]] = struct.pack(">BbB", 0xd4, BinaryEncoding.SYMBOL_TYPE, i)
+            else:
+                self.encoded_symbols[self.symbols[i]] = struct.pack(">BbH", 0xd5, BinaryEncoding.SYMBOL_TYPE, i)
+
+    # Builds the symbol table of a blueprint: the Thing ids, the keys of their
+    # states and the keys of the messages controllers send
+    # blueprint  A loaded Blueprint
+    # returns    List of symbols
+    @staticmethod
+    def get_blueprint_symbols(blueprint):
+        things = blueprint.get_things()
+        keys = set(["token", "thing", "code", "things", "thing-id", "authentication", "protocol", "category", "config", "etag", "resume-token", "batch"])
+        for thing in things:
+            keys.update(thing.get_state().keys())
+        return sorted(map(lambda t: t.id, things)) + sorted(keys)
+
+    def encode(self, obj):
+        out = bytearray()
+        self.encode_into(obj, out)
+        return bytes(out)
+
+    def decode(self, data):
+        (obj, offset) = self.decode_from(memoryview(data), 0)
+        if offset != len(data):
+            raise ValueError("Trailing bytes after a binary message")
+        return obj
+
+    def encode_member(self, key, value):
+        out = bytearray()
+        self.encode_into(key, out)
+        self.encode_into(value, out)
+        return bytes(out)
+
+    def encode_map(self, members):
+        return self.encode_map_start(len(members)) + self.MAP_SEPARATOR.join(members) + self.MAP_END
+
+    def encode_map_start(self, num_members):
+        return self.encode_header(num_members, 0x80, 0xde)
+
+    def get_parameters(self):
+        return {"symbols": self.symbols}
+
+    # length   Number of items of a map/array
+    # fixed    First byte of the fixed-size header (0x80 for maps, 0x90 for arrays)
+    # prefix   First byte of the 16-bit header (0xde for maps, 0xdc for arrays)
+    # returns  The header of the map/array
+    def encode_header(self, length, fixed, prefix):
+        if length < 16:
+            return BinaryEncoding.FIXED_HEADERS[fixed | length]
+        elif length < 0x10000:
+            return struct.pack(">BH", prefix, length)
+        return struct.pack(">BI", prefix + 1, length)
+
+    # Encodes an object at the end of a buffer
+    # obj  JSON-serializable object
+    # out  bytearray to append to
+    def encode_into(self, obj, out):
+        t = type(obj) # most common types first
+        if t is str:
+            symbol = self.encoded_symbols.get(obj, None)
+            if symbol != None:
+                out += symbol
+            else:
+                data = obj.encode("utf-8")
+                if len(data) < 32:
+                    out.append(0xa0 | len(data))
+                elif len(data) < 0x100:
+                    out += struct.pack(">BB", 0xd9, len(data))
+                elif len(data) < 0x10000:
+                    out += struct.pack(">BH", 0xda, len(data))
+                else:
+                    out += struct.pack(">BI", 0xdb, len(data))
+                out += data
+        elif t is dict:
+            out += self.encode_header(len(obj), 0x80, 0xde)
+            for (key, value) in obj.items():
+                self.encode_into(key, out)
+                self.encode_into(value, out)
+        elif t is int:
+            if 0 <= obj < 0x80:
+                out.append(obj)
+            else:
+                self.encode_int(obj, out)
+        elif obj is None:
+            out.append(0xc0)
+        elif obj is True:
+            out.append(0xc3)
+        elif obj is False:
+            out.append(0xc2)
+        elif t is float:
+            out += struct.pack(">Bd", 0xcb, obj)
+        elif isinstance(obj, (list, tuple)):
+            out += self.encode_header(len(obj), 0x90, 0xdc)
+            for value in obj:
+                self.encode_into(value, out)
+        elif isinstance(obj, dict):
+            self.encode_into(dict(obj), out)
+        elif isinstance(obj, int):
+            self.encode_int(int(obj), out)
+        elif isinstance(obj, float):
+            out += struct.pack(">Bd", 0xcb, float(obj))
+        else:
+            raise TypeError("Cannot encode {}".format(type(obj)))
+
+    def encode_int(self, value, out):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xff)
+        elif 0 <= value < 0x100:
+            out += struct.pack(">BB", 0xcc, value)
+        elif 0 <= value < 0x10000:
+            out += struct.pack(">BH", 0xcd, value)
+        elif 0 <= value < 0x100000000:
+            out += struct.pack(">BI", 0xce, value)
+        elif 0 <= value:
+            out += struct.pack(">BQ", 0xcf, value)
+        elif -0x80 <= value:
+            out += struct.pack(">Bb", 0xd0, value)
+        elif -0x8000 <= value:
+            out += struct.pack(">Bh", 0xd1, value)
+        elif -0x80000000 <= value:
+            out += struct.pack(">Bi", 0xd2, value)
+        else:
+            out += struct.pack(">Bq", 0xd3, value)
+
+    # Decodes an object from a buffer
+    # data     memoryview of the buffer
+    # offset   Offset of the object in the buffer
+    # returns  A tuple (decoded object, offset after the object)
+    def decode_from(self, data, offset):
+        b = data[offset]
+        offset += 1
+        if b < 0x80:
+            return (b, offset)
+        elif b >= 0xe0:
+            return (b - 0x100, offset)
+        elif b & 0xf0 == 0x80:
+            return self.decode_map(data, offset, b & 0x0f)
+        elif b & 0xf0 == 0x90:
+            return self.decode_array(data, offset, b & 0x0f)
+        elif b & 0xe0 == 0xa0:
+            return self.decode_str(data, offset, b & 0x1f)
+        elif b == 0xc0:
+            return (None, offset)
+        elif b == 0xc2:
+            return (False, offset)
+        elif b == 0xc3:
+            return (True, offset)
+        elif b in BinaryEncoding.FIXED_FORMATS:
+            fmt = BinaryEncoding.FIXED_FORMATS[b]
+            return (struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt))
+        elif b in (0xd9, 0xda, 0xdb):
+            fmt = BinaryEncoding.LENGTH_FORMATS[b]
+            return self.decode_str(data, offset + struct.calcsize(fmt), struct.unpack_from(fmt, data, offset)[0])
+        elif b in (0xdc, 0xdd):
+            fmt = BinaryEncoding.LENGTH_FORMATS[b]
+            return self.decode_array(data, offset + struct.calcsize(fmt), struct.unpack_from(fmt, data, offset)[0])
+        elif b in (0xde, 0xdf):
+            fmt = BinaryEncoding.LENGTH_FORMATS[b]
+            return self.decode_map(data, offset + struct.calcsize(fmt), struct.unpack_from(fmt, data, offset)[0])
+        elif b in (0xd4, 0xd5):
+            fmt = ">bB" if b == 0xd4 else ">bH"
+            (ext_type, index) = struct.unpack_from(fmt, data, offset)
+            if ext_type != BinaryEncoding.SYMBOL_TYPE:
+                raise ValueError("Unknown extension type {}".format(ext_type))
+            return (self.symbols[index], offset + struct.calcsize(fmt))
+        raise ValueError("Unsupported binary type 0x{:02x}".format(b))
+
+    def decode_str(self, data, offset, length):
+        if offset + length > len(data):
+            raise ValueError("Truncated string")
+        return (bytes(data[offset:offset+length]).decode("utf-8"), offset + length)
+
+    def decode_array(self, data, offset, length):
+        array = []
+        for i in range(length):
+            (value, offset) = self.decode_from(data, offset)
+            array.append(value)
+        return (array, offset)
+
+    def decode_map(self, data, offset, length):
+        obj = {}
+        for i in range(length):
+            (key, offset) = self.decode_from(data, offset)
+            (value, offset) = self.decode_from(data, offset)
+            obj[key] = value
+        return (obj, offset)
+
+    FIXED_HEADERS = list(map(lambda b: bytes([b]), range(0x100))) # byte -> bytes of that byte
+
+    # first byte -> struct format of fixed-size values
+    FIXED_FORMATS = {
+        0xca: ">f", 0xcb: ">d",
+        0xcc: ">B", 0xcd: ">H", 0xce: ">I", 0xcf: ">Q",
+        0xd0: ">b", 0xd1: ">h", 0xd2: ">i", 0xd3: ">q",
+    }
+
+    # first byte -> struct format of the length of strings/arrays/maps
+    LENGTH_FORMATS = {
+        0xd9: ">B", 0xda: ">H", 0xdb: ">I",
+        0xdc: ">H", 0xdd: ">I",
+        0xde: ">H", 0xdf: ">I",
+    }
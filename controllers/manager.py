@@ -1,9 +1,13 @@
+from core.scheduler import earliest_time
 from logs import Log
 from config.controllers_config import CONTROLLERS_CONFIG
 from controllers.tcp_socket_controllers import TCPSocketConnectionManager, TCPSSLSocketConnectionManager
 from controllers.authentication import ControllerAuthentication, TOKEN_TYPE
+from controllers.controller_base import StateFragmentCache
+from controllers.encodings import JSONEncoding, BinaryEncoding
 
 from functools import reduce
+import zlib
 
 class CONTROL_CODES:
     GET_BLUEPRINT = 0       # Ask for the blueprint
@@ -11,6 +15,7 @@ class CONTROL_CODES:
     SET_LISTENERS = 2       # Set which Things to listen to updates from
     RESET_QRCODE = 3        # Request QR code to be reset (sent by controllers)
     SET_QRCODE = 4          # Set the QR code (sent by a Hub)
+    GET_STATS = 5           # Ask for the loop statistics and timing histograms
 
 #
 # Controllers manager is responsible for all interaction with controller
@@ -20,6 +25,19 @@ class ControllersManager(object):
     def __init__(self, core):
         self.core = core
         self.connected_controllers = {} # origin_name -> list of connected controllers from that origin
+        self.num_connected_controllers = 0 # total number of controllers in connected_controllers
+        self.controllers_by_type = {} # token type -> dictionary of authenticated controllers with that token type -> None (in order)
+        self.controller_types = {} # authenticated controller -> its token type in controllers_by_type
+        self.state_fragments = StateFragmentCache() # encoded Thing states shared by the controllers
+        self.view_config_cache = {} # (encoding name, compressed, with config) -> (blueprint version, beginning of the encoded view up to the config)
+        self.view_things_cache = {} # (encoding name, compressed) -> ((blueprint version, state bus version), rest of the encoded view)
+        self.thing_commands = [] # list of (controller, Thing, command, batch) state changes received since the last update (in order)
+        self.thing_batches = [] # batches received since the last update, acknowledged once their commands are applied
+        self.next_origin_index = 0 # origin that goes first when handling queued commands (rotates every tick)
+        self.encodings = dict(map(lambda e: (e.name, e), [ # encodings controllers can negotiate
+            JSONEncoding(),
+            BinaryEncoding(BinaryEncoding.get_blueprint_symbols(core.blueprint)),
+        ]))
         self.connection_managers = [
             TCPSocketConnectionManager(self),
             TCPSSLSocketConnectionManager(self),
@@ -27,10 +45,12 @@ class ControllersManager(object):
         ControllerAuthentication.initialize()
 
     # Checks if a connection from the given origin is allowed
-    def can_connect_from_origin(self, origin):
+    # origin       Origin of the connection (IP)
+    # num_pending  Number of connections from the origin that are not controllers yet (e.g. TLS handshakes)
+    def can_connect_from_origin(self, origin, num_pending=0):
         return \
-            (origin not in self.connected_controllers or len(self.connected_controllers[origin]) < CONTROLLERS_CONFIG.MAX_CONNECTIONS_PER_ORIGIN) and \
-            reduce(lambda a, b: a+b, map(lambda cc: len(cc), self.connected_controllers.values()), 0) < CONTROLLERS_CONFIG.MAX_CONNECTIONS
+            len(self.connected_controllers.get(origin, [])) + num_pending < CONTROLLERS_CONFIG.MAX_CONNECTIONS_PER_ORIGIN and \
+            self.num_connected_controllers < CONTROLLERS_CONFIG.MAX_CONNECTIONS
 
     # Registers a controller
     # controller  A Controller object that is connected
@@ -41,20 +61,32 @@ class ControllersManager(object):
                 controller.destroy_selectible()
             else:
                 self.connected_controllers[controller.origin_name].append(controller)
+                self.num_connected_controllers += 1
         else:
             self.connected_controllers[controller.origin_name] = [controller]
+            self.num_connected_controllers += 1
 
     # Disconnects a controller and calls .disconnect() on it
     # controller  The controller to disconnect
     def deregister_controller(self, controller):
-        for c in self.connected_controllers[controller.origin_name]:
-            if c == controller:
-                self.connected_controllers[c.origin_name].remove(c)
-                break
+        controllers = self.connected_controllers.get(controller.origin_name, [])
+        if controller in controllers: # at most MAX_CONNECTIONS_PER_ORIGIN controllers
+            controllers.remove(controller)
+            self.num_connected_controllers -= 1
+            if len(controllers) == 0:
+                del self.connected_controllers[controller.origin_name]
+        self.set_controller_type(controller, None)
 
     # called to periodically update this manager
-    # cur_time_s  current time in seconds
-    def update(self, cur_time_s):
+    # cur_time_s       current time in seconds
+    # handle_commands  whether or not to handle the queued commands (only done once per tick)
+    def update(self, cur_time_s, handle_commands=True):
+        if handle_commands:
+            self.handle_commands()
+            self.apply_thing_commands()
+        self.core.state_bus.flush() # publish Thing changes to the controllers
+        self.state_fragments.clear()
+
         for C in self.connection_managers:
             C.update(cur_time_s)
 
@@ -67,6 +99,131 @@ class ControllersManager(object):
                 if not keep:
                     controller.destroy_selectible()
 
+    # cur_time_s  Current time in seconds
+    # returns     Time at which this manager needs to be updated regardless of I/O, None if never
+    def get_next_update_time(self, cur_time_s):
+        times = list(map(lambda C: C.get_next_update_time(cur_time_s), self.connection_managers))
+        if len(self.thing_commands) > 0 or len(self.thing_batches) > 0:
+            times.append(cur_time_s)
+        for controllers in self.connected_controllers.values():
+            if any(map(lambda c: len(c.queued_commands) > 0, controllers)):
+                times.append(cur_time_s) # commands were deferred to this tick
+                break
+        for controllers in self.connected_controllers.values():
+            times += list(map(lambda c: c.get_next_write_time(cur_time_s), controllers))
+            times += list(map(lambda c: c.get_next_flush_time(), controllers))
+        return earliest_time(times)
+
+    # Handles the commands queued by the controllers, one command per connection at a time,
+    # going round-robin across origins (the first origin changes every tick). Each connection
+    # handles at most COMMANDS_PER_TICK commands per tick, the rest wait for the next tick so
+    # that one busy controller cannot delay the others
+    def handle_commands(self):
+        origins = list(self.connected_controllers.keys())
+        if len(origins) == 0:
+            return
+        self.next_origin_index = (self.next_origin_index + 1) % len(origins)
+        origins = origins[self.next_origin_index:] + origins[:self.next_origin_index]
+        controllers = []
+        for origin in origins:
+            controllers += list(filter(lambda c: len(c.queued_commands) > 0, self.connected_controllers[origin]))
+
+        budget = CONTROLLERS_CONFIG.COMMANDS_PER_TICK
+        while budget > 0 and len(controllers) > 0:
+            budget -= 1
+            for controller in controllers:
+                try:
+                    controller.handle_queued_command()
+                except:
+                    Log.error("Failed to handle a command from {}".format(str(controller)), exception=True)
+            controllers = list(filter(lambda c: len(c.queued_commands) > 0, controllers))
+
+        for controller in controllers:
+            controller.num_deferrals += 1
+
+    # Builds the blueprint view (same as encoding Blueprint.get_controller_view()) from two
+    # chunks encoded separately: the config, cached until the blueprint changes, and the
+    # Things, cached until a Thing state changes (so the config is not encoded or
+    # compressed again when a Thing changes)
+    # encoding     Encoding of the view (see self.encodings)
+    # compressed   Whether or not to compress the encoded view (as standalone raw deflate
+    #              chunks ending with a full flush, so it can be spliced into a deflate stream)
+    # with_config  Whether or not to include the config (otherwise only its "etag" is included)
+    # returns      The encoded blueprint view
+    def get_encoded_view(self, encoding, compressed=False, with_config=True):
+        return self.get_view_config_chunk(encoding, compressed, with_config) + self.get_view_things_chunk(encoding, compressed)
+
+    # encoding     Encoding of the view
+    # compressed   Whether or not to compress the chunk
+    # with_config  Whether or not to include the config (otherwise only its "etag" is included)
+    # returns      The beginning of the encoded view, up to its config (or etag) member
+    def get_view_config_chunk(self, encoding, compressed, with_config):
+        blueprint = self.core.blueprint
+        key = (encoding.name, compressed, with_config)
+        cached = self.view_config_cache.get(key, None)
+        if cached == None or cached[0] != blueprint.version:
+            if compressed:
+                chunk = ControllersManager.compress_chunk(self.get_view_config_chunk(encoding, False, with_config))
+            else:
+                controller_config = blueprint.get_controller_config()
+                if with_config:
+                    member = encoding.encode_member("config", controller_config)
+                else:
+                    member = encoding.encode_member("etag", controller_config["etag"])
+                chunk = encoding.encode_map_start(len(blueprint.get_things()) + 1) + member
+            cached = self.view_config_cache[key] = (blueprint.version, chunk)
+        return cached[1]
+
+    # encoding    Encoding of the view
+    # compressed  Whether or not to compress the chunk
+    # returns     The rest of the encoded view: the members of the Things (with their states)
+    def get_view_things_chunk(self, encoding, compressed):
+        blueprint = self.core.blueprint
+        state_bus = self.core.state_bus
+        versions = (blueprint.version, state_bus.version)
+        key = (encoding.name, compressed)
+        cached = self.view_things_cache.get(key, None)
+        if cached == None or cached[0] != versions:
+            if compressed:
+                chunk = ControllersManager.compress_chunk(self.get_view_things_chunk(encoding, False))
+            else:
+                members = []
+                for thing in blueprint.get_things():
+                    state = state_bus.get_state(thing.id)
+                    if state == None: # not published yet
+                        members.append(encoding.encode_member(thing.id, blueprint.get_thing_view(thing)))
+                    else:
+                        members.append(self.state_fragments.get(encoding.name + "-view", thing.id, state_bus.get_version(thing.id),
+                            lambda: encoding.encode_member(thing.id, blueprint.get_thing_view(thing, state))))
+                chunk = b"".join(map(lambda member: encoding.MAP_SEPARATOR + member, members)) + encoding.MAP_END
+            cached = self.view_things_cache[key] = (versions, chunk)
+        return cached[1]
+
+    # data     Bytes to compress
+    # returns  data as a standalone raw deflate chunk ending with a full flush
+    @staticmethod
+    def compress_chunk(data):
+        compressor = zlib.compressobj(CONTROLLERS_CONFIG.COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+    # returns  Statistics of the connected controllers
+    def get_stats(self):
+        stats = {}
+        for controllers in self.connected_controllers.values():
+            for controller in controllers:
+                stats[str(controller)] = controller.get_stats()
+        return stats
+
+    # returns  Number of queued commands and of deferrals of the controllers of every origin
+    def get_origin_stats(self):
+        stats = {}
+        for (origin, controllers) in self.connected_controllers.items():
+            stats[origin] = {
+                "queued_commands": sum(map(lambda c: len(c.queued_commands), controllers)),
+                "deferrals": sum(map(lambda c: c.num_deferrals, controllers)),
+            }
+        return stats
+
     # Called when this manager needs to free all its resources
     def cleanup(self):
         for controllers in list(self.connected_controllers.values()):
@@ -74,15 +231,22 @@ class ControllersManager(object):
                 controller.destroy_selectible()
         for C in self.connection_managers:
             C.cleanup()
+        ControllerAuthentication.cleanup()
 
     # Gets all connected and authenticated controllers with the given token type
     def get_controllers_by_type(self, token_type):
-        ret = []
-        for origin in self.connected_controllers:
-            for controller in self.connected_controllers[origin]:
-                if controller.authenticated_user and controller.authenticated_user.token_type == token_type:
-                    ret.append(controller)
-        return ret
+        return list(self.controllers_by_type.get(token_type, {}).keys())
+
+    # Moves a controller to the controllers of a token type
+    # controller  A connected controller
+    # token_type  Token type of the controller (None to remove it from the controllers by type)
+    def set_controller_type(self, controller, token_type):
+        old_token_type = self.controller_types.pop(controller, None)
+        if old_token_type != None:
+            del self.controllers_by_type[old_token_type][controller]
+        if token_type != None:
+            self.controller_types[controller] = token_type
+            self.controllers_by_type.setdefault(token_type, {})[controller] = None
 
     # Called when a controller sends a command
     # controller  Controller that sent the command
@@ -100,6 +264,16 @@ class ControllersManager(object):
             controller.destroy_selectible()
             return # don't process anything before authentication
 
+        # the authentication object can ask for a different encoding and compression
+        authentication = command.get("authentication", None)
+        if type(authentication) is dict:
+            if "protocol" in authentication:
+                controller.set_protocol(authentication["protocol"])
+            if "compression" in authentication:
+                controller.set_compression(authentication["compression"])
+            if "resume-token" in authentication:
+                controller.resume_session(authentication["resume-token"])
+
         # heartbeat
         if len(command) == 0:
             controller.send_data({}) # reply
@@ -107,34 +281,52 @@ class ControllersManager(object):
 
         # Thing state change command
         elif "thing" in command:
-            thing_id = command["thing"]
-            if controller.things_listening != None and thing_id not in controller.things_listening:
-                Log.verboze("ControllersManager::on_command({}, {}) BLOCKED (no access)".format(str(self), command))
+            self.queue_thing_command(controller, command)
+
+        # Batch of Thing state change commands (applied in order, acknowledged once they are applied)
+        elif "batch" in command:
+            commands = command["batch"]
+            if type(commands) is not list:
+                Log.warning("Controller {} sent a batch that is not a list".format(str(controller)))
                 return
-            thing = self.core.blueprint.get_thing(thing_id)
-            thing.set_state(command, token_from=command.get("token", ""))
+            batch = {"controller": controller, "num_applied": 0} # num_applied counts the queued commands until they are applied
+            for thing_command in commands:
+                if type(thing_command) is dict and "thing" in thing_command:
+                    if self.queue_thing_command(controller, thing_command, batch):
+                        batch["num_applied"] += 1
+                else:
+                    Log.warning("Controller {} sent a batched command that is not a Thing state change".format(str(controller)))
+            self.thing_batches.append(batch)
 
         # Control command
         elif "code" in command:
+            # Thing commands are applied at the end of the tick, but a control command must see the
+            # ones its controller sent before it (e.g. a view requested right after a Thing change)
+            if any(map(lambda tc: tc[0] == controller, self.thing_commands)):
+                self.apply_thing_commands()
+                self.core.state_bus.flush()
             try:
                 if command["code"] == CONTROL_CODES.GET_BLUEPRINT:
-                    controller.send_data(self.core.blueprint.get_controller_view(), cache=False)
+                    # a controller that already has the config can send its etag to only get the Thing states
+                    controller.send_controller_view(with_config=command.get("etag", None) != self.core.blueprint.get_config_etag())
                 elif command["code"] == CONTROL_CODES.GET_THING_STATE:
                     controller.invalidate_cache(thing_id=command.get("thing-id", None))
                 elif command["code"] == CONTROL_CODES.SET_LISTENERS:
                     listeners = command.get("things", None)
                     if listeners and type(listeners) is list and reduce(lambda l1, l2: l1 and l2, map(lambda s: type(s) is str, listeners)):
-                        controller.things_listening = listeners
+                        controller.set_things_listening(listeners)
                 elif command["code"] == CONTROL_CODES.RESET_QRCODE:
                     # find a hub and forward the code to
                     hubs = self.get_controllers_by_type(TOKEN_TYPE.HUB)
                     if len(hubs) > 0:
                         hubs[0].send_data({"code": CONTROL_CODES.RESET_QRCODE})
                 elif command["code"] == CONTROL_CODES.SET_QRCODE:
-                    self.core.blueprint.display["QRCodeAddress"] = command.get("qr-code", "")
+                    self.core.blueprint.set_display("QRCodeAddress", command.get("qr-code", ""))
                     controllers = self.get_controllers_by_type(TOKEN_TYPE.CONTROLLER)
                     for controller in controllers:
-                        controller.send_data(self.core.blueprint.get_controller_view(), cache=False)
+                        controller.send_controller_view()
+                elif command["code"] == CONTROL_CODES.GET_STATS:
+                    controller.send_data({"code": CONTROL_CODES.GET_STATS, "stats": self.core.get_stats()})
             except:
                 Log.error("Failed to respond to a control command", exception=True)
 
@@ -146,6 +338,58 @@ class ControllersManager(object):
                 Log.error("Failed to respond to a port update command", exception=True)
 
 
+    # Queues a Thing state change command sent by a controller, to be applied on the next
+    # update. A command from the same controller that changes the same keys of the same Thing
+    # as the last queued command replaces it if only the latest value of these keys matters
+    # (Thing.MERGEABLE_STATE_KEYS, e.g. the many commands of a dimmer slider being dragged)
+    # controller  Controller that sent the command
+    # command     JSON command with a "thing" field
+    # batch       Batch the command is part of (None if it was not batched)
+    # returns     Whether or not the command was accepted
+    def queue_thing_command(self, controller, command, batch=None):
+        thing_id = command["thing"]
+        if controller.things_listening != None and thing_id not in controller.things_listening:
+            Log.verboze("ControllersManager::on_command({}, {}) BLOCKED (no access)".format(str(self), command))
+            return False
+        thing = self.core.blueprint.get_thing(thing_id)
+        if thing == None:
+            Log.warning("Controller {} sent a command to an unknown Thing {}".format(str(controller), thing_id))
+            return False
+        if len(self.thing_commands) > 0:
+            (last_controller, last_thing, last_command, last_batch) = self.thing_commands[-1]
+            keys = ControllersManager.get_command_keys(command)
+            if last_controller == controller and last_thing == thing and len(keys) > 0 and \
+                    keys <= thing.MERGEABLE_STATE_KEYS and ControllersManager.get_command_keys(last_command) == keys:
+                self.thing_commands[-1] = (controller, thing, command, batch) # the last value (and token) wins
+                return True
+        self.thing_commands.append((controller, thing, command, batch))
+        return True
+
+    # command  JSON Thing state change command
+    # returns  The set of state keys the command changes
+    @staticmethod
+    def get_command_keys(command):
+        return set(command.keys()) - set(["thing", "token"])
+
+    # Applies the queued Thing state change commands in the order they were received, then
+    # acknowledges the batches with the number of their commands that were applied
+    def apply_thing_commands(self):
+        thing_commands = self.thing_commands
+        self.thing_commands = []
+        for (controller, thing, command, batch) in thing_commands:
+            try:
+                thing.set_state(command, token_from=command.get("token", ""))
+            except:
+                Log.error("Failed to apply a command to Thing {}".format(thing.id), exception=True)
+                if batch != None:
+                    batch["num_applied"] -= 1
+
+        thing_batches = self.thing_batches
+        self.thing_batches = []
+        for batch in thing_batches:
+            batch["controller"].send_data({"batch": batch["num_applied"]})
+
     # Called when a controller authenticates
     def on_controller_authenticated(self, controller):
-        pass
+        if controller in self.connected_controllers.get(controller.origin_name, []):
+            self.set_controller_type(controller, controller.authenticated_user.token_type)
@@ -1,5 +1,6 @@
 from controllers.controller_base import Controller
 from logs import Log
+from config.controllers_config import CONTROLLERS_CONFIG
 
 from things.air_conditioner import CentralAC
 from things.light import LightSwitch, Dimmer
@@ -8,6 +9,8 @@ from things.hotel_controls import HotelControls
 
 import struct
 import json
+import zlib
+import ssl
 import types
 import re
 
@@ -16,11 +19,19 @@ import re
 #
 class TCPSocketController(Controller):
     MAXIMUM_COMMAND_LENGTH = 1024 * 32
+    RECEIVE_BUFFER_SIZE = 1024 * 64 # must fit the largest command and its length
 
     def __init__(self, controllers_manager, conn, addr):
         self.connection = conn
+        self.connection.setblocking(False) # reads are drained until there is nothing left
         self.address = addr
-        self.buffer = bytearray([])
+        self.buffer = bytearray(self.RECEIVE_BUFFER_SIZE) # received bytes, the unparsed ones are buffer[read_start:read_end]
+        self.buffer_view = memoryview(self.buffer)
+        self.read_start = 0
+        self.read_end = 0
+        self.reads_paused = False # whether or not reading stopped because the command queue was full
+        self.encoding = controllers_manager.encodings["json"]
+        self.compressor = None # deflate context of the outgoing stream (None if not compressed)
         self.initialize_selectible_fd(conn)
         super(TCPSocketController, self).__init__(controllers_manager, addr[0])
 
@@ -36,39 +47,141 @@ class TCPSocketController(Controller):
 
     # Called when the socket has pending bytes to read
     def on_read_ready(self, cur_time_s):
-        read = self.connection.recv(1024)
-        if not read:
-            Log.verboze("Client hung up: {}".format(str(self)))
-            return False
+        return self.read_commands()
+
+    # Reads everything the socket has into the receive buffer and queues every complete
+    # command (the manager handles them)
+    # returns  False if the connection needs to be closed, True otherwise
+    def read_commands(self):
         try:
-            self.buffer += read
-            while len(self.buffer) >= 4:
-                command_len = struct.unpack('<I', self.buffer[:4])[0]
-                if len(self.buffer) >= 4 + command_len:
-                    command = self.buffer[4:4+command_len]
-                    self.buffer = self.buffer[4+command_len:]
-                    loaded_json = json.loads(command.decode("utf-8"))
-                    if type(loaded_json) is str: # ???? (some decoding shit)
-                        loaded_json = json.loads(loaded_json)
-                    self.on_command(loaded_json)
-                elif command_len > self.MAXIMUM_COMMAND_LENGTH:
-                    Log.warning("Controller sent a command that is too long (or corrupted)")
+            while True:
+                if len(self.queued_commands) >= CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS:
+                    self.reads_paused = True # read the rest once the queued commands are handled
+                    return True
+                if self.read_end == len(self.buffer):
+                    self.compact_buffer()
+                try:
+                    nread = self.connection.recv_into(self.buffer_view[self.read_end:])
+                except (BlockingIOError, InterruptedError, ssl.SSLWantReadError):
+                    return True # nothing left to read
+                if nread == 0:
+                    Log.verboze("Client hung up: {}".format(str(self)))
+                    return False
+                self.read_end += nread
+                if not self.parse_commands():
                     return False
-                else:
-                    break
-            return True
         except:
-            Log.warning("TCPSocketController::on_read_ready()", exception=True)
+            Log.warning("TCPSocketController::read_commands()", exception=True)
             return False
 
+    # Queues the complete commands in the receive buffer (parsed in place)
+    # returns  False if the buffer is corrupted, True otherwise
+    def parse_commands(self):
+        while self.read_end - self.read_start >= 4 and len(self.queued_commands) < CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS:
+            command_len = struct.unpack_from('<I', self.buffer, self.read_start)[0]
+            if command_len > self.MAXIMUM_COMMAND_LENGTH:
+                Log.warning("Controller sent a command that is too long (or corrupted)")
+                return False
+            command_end = self.read_start + 4 + command_len
+            if command_end > self.read_end:
+                break
+            command = self.encoding.decode(bytes(self.buffer_view[self.read_start+4:command_end]))
+            self.read_start = command_end
+            self.queue_command(command)
+        if self.read_start == self.read_end: # everything is parsed, start over without copying
+            self.read_start = self.read_end = 0
+        return True
+
+    # Handles the oldest queued command, then resumes reading if it stopped because the
+    # queue was full (the socket might not become readable again: the bytes can already
+    # be in the receive buffer or decrypted by the TLS layer)
+    def handle_queued_command(self):
+        super(TCPSocketController, self).handle_queued_command()
+        if self.reads_paused and len(self.queued_commands) < CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS:
+            self.reads_paused = False
+            if not self.parse_commands() or not self.read_commands():
+                self.destroy_selectible()
+
+    # Moves the unparsed bytes to the beginning of the receive buffer (only needed
+    # when the buffer is full, so each byte is moved at most once per command)
+    def compact_buffer(self):
+        unparsed = self.read_end - self.read_start
+        self.buffer_view[:unparsed] = self.buffer_view[self.read_start:self.read_end]
+        self.read_start = 0
+        self.read_end = unparsed
+
     # Called when data needs to be sent to the remote controller on the socket
-    def send_data(self, json_data, cache=True):
-        super(TCPSocketController, self).send_data(json_data, cache)
+    def send_data(self, json_data):
+        super(TCPSocketController, self).send_data(json_data)
         try:
-            json_data = json.dumps(json_data)
-            msg = struct.pack('<I', len(json_data)) + bytearray(json_data.encode("utf-8"))
-            self.write_to_fd(msg)
+            self.write_message(self.encoding.encode(json_data))
             return True
         except:
             Log.warning("TCPSocketController::send_data({}) Failed".format(str(json_data)), exception=True)
             return False
+
+    # Sends the states of Things as one object spliced from the encoded states
+    # shared by all the controllers (same bytes as send_data would produce)
+    # thing_ids     IDs of the Things to send
+    # resume_token  Resume token to send with the states as "resume-token" (None to not send it)
+    def write_states(self, thing_ids, resume_token=None):
+        try:
+            encoding = self.encoding
+            fragments = list(map(lambda thing_id: self.manager.state_fragments.get(
+                encoding.name, thing_id, self.state_bus.get_version(thing_id),
+                lambda: encoding.encode_member(thing_id, self.state_bus.get_state(thing_id))), thing_ids))
+            if resume_token != None:
+                fragments.append(self.manager.state_fragments.get(encoding.name + "-resume", "", resume_token,
+                    lambda: encoding.encode_member("resume-token", resume_token)))
+            self.write_message(encoding.encode_map(fragments))
+            return True
+        except:
+            Log.warning("TCPSocketController::write_states({}) Failed".format(str(thing_ids)), exception=True)
+            return False
+
+    # Switches the encoding of the messages (replies in the previous encoding first)
+    # protocol  Name of the requested encoding
+    def set_protocol(self, protocol):
+        encoding = self.manager.encodings.get(protocol, self.encoding) if type(protocol) is str else self.encoding
+        reply = {"protocol": encoding.name}
+        reply.update(encoding.get_parameters())
+        self.send_data(reply)
+        self.encoding = encoding
+
+    # Enables raw deflate compression of everything sent after the (uncompressed) reply.
+    # All the messages are compressed with one persistent context, each message is
+    # flushed so it can be decompressed as soon as it is received
+    # compression  Name of the requested compression ("deflate")
+    def set_compression(self, compression):
+        enabled = compression == "deflate"
+        self.send_data({"compression": "deflate" if enabled else "none"})
+        if enabled and self.compressor == None:
+            self.compressor = zlib.compressobj(CONTROLLERS_CONFIG.COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    # Sends the blueprint view, encoded (and compressed) once for all the controllers
+    # with_config  Whether or not to include the config (otherwise only its "etag" is included)
+    def send_controller_view(self, with_config=True):
+        try:
+            if self.compressor:
+                # a full flush resets the history of the stream so that the standalone
+                # compressed view can be spliced into it
+                self.write_frame(self.compressor.flush(zlib.Z_FULL_FLUSH) + self.manager.get_encoded_view(self.encoding, compressed=True, with_config=with_config))
+            else:
+                self.write_frame(self.manager.get_encoded_view(self.encoding, with_config=with_config))
+            return True
+        except:
+            Log.warning("TCPSocketController::send_controller_view() Failed", exception=True)
+            return False
+
+    # Writes a message to the socket (compressed if compression is enabled)
+    # msg  Bytes of the message
+    def write_message(self, msg):
+        if self.compressor:
+            msg = self.compressor.compress(msg) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.write_frame(msg)
+
+    # Writes a length-prefixed frame to the socket
+    # payload  Bytes of the frame
+    def write_frame(self, payload):
+        self.write_to_fd(struct.pack('<I', len(payload)))
+        self.write_to_fd(payload) # not copied (written together with the length)
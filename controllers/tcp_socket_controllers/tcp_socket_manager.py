@@ -1,5 +1,5 @@
 from controllers.connection_manager import ConnectionManager
-from core.select_service import Selectible
+from core.select_service import Selectible, SelectService
 from controllers.tcp_socket_controllers.tcp_socket_controller import TCPSocketController
 from logs import Log
 from config.controllers_config import CONTROLLERS_CONFIG
@@ -35,9 +35,10 @@ class TCPHostedSocket(Selectible):
     def on_read_ready(self, cur_time_s):
         try:
             conn, addr = self.sock.accept()
-            if self.connection_manager.controllers_manager.can_connect_from_origin(addr[0]):
+            num_handshakes = self.connection_manager.get_num_handshakes(addr[0])
+            if self.connection_manager.controllers_manager.can_connect_from_origin(addr[0], num_handshakes):
                 Log.info("Accepting controller on manager {}:{}".format(self.ip, self.port))
-                self.controller_class(self.connection_manager.controllers_manager, conn, addr) # registers itself
+                self.on_connection_accepted(conn, addr, cur_time_s)
             else:
                 conn.close()
                 Log.warning("Controller rejected from origin {} (already at the limit)".format(addr[0]))
@@ -48,6 +49,13 @@ class TCPHostedSocket(Selectible):
             return False
         return True
 
+    # Called when a connection is accepted (and allowed)
+    # conn        Accepted socket
+    # addr        Address of the remote end
+    # cur_time_s  Current time in seconds
+    def on_connection_accepted(self, conn, addr, cur_time_s):
+        self.controller_class(self.connection_manager.controllers_manager, conn, addr) # registers itself
+
     # Creates and binds a server socket on a given ip
     # ip  IP to bind the server socket to
     # returns  The create server socket
@@ -69,32 +77,113 @@ class TCPHostedSocket(Selectible):
         return s
 
 class TCPSSLHostedSocket(TCPHostedSocket):
+    ssl_context = None # SSLContext shared by all the TLS connections (so that sessions can be resumed)
+
     def __init__(self, connection_manager, interface, ip):
         super(TCPSSLHostedSocket, self).__init__(connection_manager, interface, ip)
+        TCPSSLHostedSocket.get_ssl_context()
 
-    # similar to TCPHostedSocket but wraps in SSL socket
+    # same server socket as TCPHostedSocket (on the TLS port), accepted connections are wrapped in TLS
     @staticmethod
     def create_server_socket(ip, port=CONTROLLERS_CONFIG.SOCKET_SERVER_SSL_BIND_PORT):
-        s = TCPHostedSocket.create_server_socket(ip, port)
-        if s and os.path.isfile(CONTROLLERS_CONFIG.SSL_KEY_FILE) > 0 and os.path.isfile(CONTROLLERS_CONFIG.SSL_CERT_FILE) > 0:
-            ssl_sock = None
+        return TCPHostedSocket.create_server_socket(ip, port)
+
+    # Wraps accepted connections in TLS, the handshake is performed by a TLSHandshake
+    # without blocking (plain TCP if there is no TLS key/certificate)
+    def on_connection_accepted(self, conn, addr, cur_time_s):
+        ssl_context = TCPSSLHostedSocket.get_ssl_context()
+        if ssl_context == None:
+            return super(TCPSSLHostedSocket, self).on_connection_accepted(conn, addr, cur_time_s)
+        if len(self.connection_manager.handshakes) >= CONTROLLERS_CONFIG.MAX_PENDING_HANDSHAKES:
+            conn.close()
+            Log.warning("TLS connection from {} rejected (too many pending handshakes)".format(addr[0]))
+            return
+        conn.setblocking(False)
+        TLSHandshake(self, ssl_context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False), addr, cur_time_s) # registers itself
+
+    # Creates the shared TLS context from the key and certificate in the config
+    # returns  The SSLContext, None if there is no key/certificate or it failed
+    @staticmethod
+    def get_ssl_context():
+        if TCPSSLHostedSocket.ssl_context == None and os.path.isfile(CONTROLLERS_CONFIG.SSL_KEY_FILE) and os.path.isfile(CONTROLLERS_CONFIG.SSL_CERT_FILE):
             try:
-                ssl_sock = ssl.wrap_socket(
-                    s,
-                    ssl_version=ssl.PROTOCOL_TLSv1_2,
-                    # cert_reqs=ssl.CERT_REQUIRED,
-                    server_side=True,
-                    keyfile=CONTROLLERS_CONFIG.SSL_KEY_FILE,
-                    certfile=CONTROLLERS_CONFIG.SSL_CERT_FILE
-                )
+                context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                if hasattr(context, "minimum_version"):
+                    context.minimum_version = ssl.TLSVersion.TLSv1_2
+                else:
+                    context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+                context.options &= ~ssl.OP_NO_TICKET # reconnecting clients can resume their session with a ticket
+                context.load_cert_chain(certfile=CONTROLLERS_CONFIG.SSL_CERT_FILE, keyfile=CONTROLLERS_CONFIG.SSL_KEY_FILE)
+                TCPSSLHostedSocket.ssl_context = context
+                Log.info("Successfully created TLS context")
             except:
-                Log.error("Failed to setup TLS server socket", exception=True)
-            if ssl_sock:
-                Log.info("Successfully created TLS server socket")
-            else:
-                Log.error("Failed to setup TLS server socket")
-            return ssl_sock
-        return s
+                Log.error("Failed to setup TLS context", exception=True)
+        return TCPSSLHostedSocket.ssl_context
+
+#
+# Performs the TLS handshake of an accepted connection whenever the socket is
+# ready, so a slow client never blocks the core. Once the handshake is done the
+# connection is handed over to a controller
+#
+class TLSHandshake(Selectible):
+    # hosted_socket  TCPSSLHostedSocket that accepted the connection
+    # conn           SSLSocket of the connection (non-blocking, handshake not done)
+    # addr           Address of the remote end
+    # cur_time_s     Current time in seconds
+    def __init__(self, hosted_socket, conn, addr, cur_time_s):
+        self.hosted_socket = hosted_socket
+        self.connection_manager = hosted_socket.connection_manager
+        self.connection = conn
+        self.address = addr
+        self.deadline = cur_time_s + CONTROLLERS_CONFIG.TLS_HANDSHAKE_TIMEOUT
+        self.initialize_selectible_fd(conn)
+        self.connection_manager.register_handshake(self)
+
+    def __str__(self):
+        return "TLS handshake {}".format(str(self.address))
+
+    def destroy_selectible(self):
+        super(TLSHandshake, self).destroy_selectible()
+        self.connection_manager.deregister_handshake(self)
+        try:
+            self.connection.close()
+        except: pass
+
+    def on_read_ready(self, cur_time_s):
+        return self.continue_handshake(cur_time_s)
+
+    def on_write_ready(self, cur_time_s):
+        return self.continue_handshake(cur_time_s)
+
+    # Continues the handshake as far as it can go without blocking
+    # cur_time_s  Current time in seconds
+    # returns     False if the handshake failed, True otherwise
+    def continue_handshake(self, cur_time_s):
+        try:
+            self.connection.do_handshake()
+        except ssl.SSLWantReadError:
+            SelectService.set_write_interest(self, False)
+            return True
+        except ssl.SSLWantWriteError:
+            SelectService.set_write_interest(self, True)
+            return True
+        except (ssl.SSLError, OSError) as e:
+            Log.warning("Error when a client tried to connect using TLS: {}".format(e))
+            return False
+
+        # hand the connection over to a controller (the same fd is registered again)
+        SelectService.deregister_selectible(self)
+        self.connection_manager.deregister_handshake(self)
+        Log.debug("TLS handshake with {} done{}".format(str(self.address), " (session resumed)" if self.connection.session_reused else ""))
+        controllers_manager = self.connection_manager.controllers_manager
+        if not controllers_manager.can_connect_from_origin(self.address[0]):
+            Log.warning("Controller rejected from origin {} (already at the limit)".format(self.address[0]))
+            self.connection.close()
+            return True
+        controller = self.hosted_socket.controller_class(controllers_manager, self.connection, self.address) # registers itself
+        if self.connection.pending() > 0: # the first commands were received with the handshake
+            SelectService.dispatch(controller, controller.on_read_ready, cur_time_s)
+        return True
 
 #
 # A socket-based connection manager for controllers
@@ -103,6 +192,8 @@ class TCPSocketConnectionManager(ConnectionManager):
     def __init__(self, controllers_manager):
         super(TCPSocketConnectionManager, self).__init__(controllers_manager)
         self.server_socks = {} # dictionary of iface name -> instance of self.hosted_socket_type on that iface
+        self.handshakes = {} # dictionary of TLSHandshake -> its deadline
+        self.handshakes_by_origin = {} # dictionary of origin (IP) -> number of pending handshakes from it
         self.reconnect_timer = 0
         self.hosted_socket_type = TCPHostedSocket
 
@@ -112,6 +203,23 @@ class TCPSocketConnectionManager(ConnectionManager):
     def deregister_server_sock(self, iface):
         del self.server_socks[iface]
 
+    def register_handshake(self, handshake):
+        self.handshakes[handshake] = handshake.deadline
+        origin = handshake.address[0]
+        self.handshakes_by_origin[origin] = self.handshakes_by_origin.get(origin, 0) + 1
+
+    def deregister_handshake(self, handshake):
+        if self.handshakes.pop(handshake, None) != None:
+            origin = handshake.address[0]
+            self.handshakes_by_origin[origin] -= 1
+            if self.handshakes_by_origin[origin] == 0:
+                del self.handshakes_by_origin[origin]
+
+    # origin   Origin (IP) of connections
+    # returns  Number of pending TLS handshakes from the origin
+    def get_num_handshakes(self, origin):
+        return self.handshakes_by_origin.get(origin, 0)
+
     # Remove interfaces no longer on the system (or their IPs changed) and add newly discovered ones
     # cur_time_s. Current time in seconds
     def update_hosting_interfaces(self, cur_time_s):
@@ -133,11 +241,22 @@ class TCPSocketConnectionManager(ConnectionManager):
         # fix the hosting interfaces
         self.update_hosting_interfaces(cur_time_s)
 
+        # drop clients that take too long to do their TLS handshake
+        for (handshake, deadline) in list(self.handshakes.items()):
+            if cur_time_s >= deadline:
+                Log.warning("TLS handshake with {} timed out".format(str(handshake.address)))
+                handshake.destroy_selectible()
+
         super(TCPSocketConnectionManager, self).update(cur_time_s)
 
+    def get_next_update_time(self, cur_time_s):
+        return min([self.reconnect_timer] + list(self.handshakes.values()))
+
     # Called when this manager needs to free all its resources
     def cleanup(self):
         super(TCPSocketConnectionManager, self).cleanup()
+        for handshake in list(self.handshakes.keys()):
+            handshake.destroy_selectible()
         for iface in list(self.server_socks):
             self.server_socks[iface].destroy_selectible()
         self.server_socks = {}
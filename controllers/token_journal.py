@@ -0,0 +1,136 @@
+from logs import Log
+from config.controllers_config import CONTROLLERS_CONFIG
+
+import os
+import json
+import time
+import queue
+import threading
+
+#
+# Append-only file of the registered users (one JSON user per line, a later
+# line for the same token replaces the earlier one). Users are written by a
+# background thread so registering a token never blocks the core: the lines
+# queued while it writes are appended together with a single fsync, and the
+# file is rewritten with only the latest line of each token once it has too
+# many replaced lines.
+#
+class TokenJournal(object):
+    # filename  Path of the journal
+    def __init__(self, filename):
+        self.filename = filename
+        self.queue = queue.Queue() # user JSONs waiting to be written (None stops the writer)
+        self.users = {} # token -> latest user JSON in the file (only used by the writer once started)
+        self.num_lines = 0 # number of user lines in the file
+        self.needs_rewrite = False # whether the file is not a clean journal (legacy format or corrupted lines)
+        self.thread = None
+
+    # Loads the users from the journal in one pass. The legacy format (a single
+    # JSON object of token -> user) is read too, and rewritten as a journal
+    # returns  A dictionary of token -> user JSON
+    def load(self):
+        corrupted_lines = 0
+        first_line_corrupted = False
+        with open(self.filename, "r") as F:
+            for line in F:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    obj = json.loads(line)
+                    if type(obj) is not dict:
+                        raise ValueError("Not a JSON object")
+                except ValueError:
+                    corrupted_lines += 1 # e.g. the last line of a write that was interrupted
+                    first_line_corrupted = first_line_corrupted or (self.num_lines == 0 and corrupted_lines == 1)
+                    continue
+                if "token" in obj:
+                    self.users[obj["token"]] = obj
+                else: # legacy format
+                    self.users.update(obj)
+                    self.needs_rewrite = True
+                self.num_lines += 1
+
+        if corrupted_lines > 0:
+            legacy_users = self.load_legacy() if first_line_corrupted else None
+            if legacy_users != None: # legacy format written over multiple lines
+                self.users = legacy_users
+                self.num_lines = len(self.users)
+            else:
+                Log.warning("Skipped {} corrupted lines in {}".format(corrupted_lines, self.filename))
+            self.needs_rewrite = True
+        return dict(self.users)
+
+    # Parses the whole file in the legacy format (a single JSON object of token -> user)
+    # returns  A dictionary of token -> user JSON, None if the file is not in the legacy format
+    def load_legacy(self):
+        try:
+            with open(self.filename, "r") as F:
+                users = json.load(F)
+        except ValueError:
+            return None # e.g. a journal with only the beginning of its first line written
+        return users if type(users) is dict else None
+
+    # Starts the background writer (rewrites the file first if needed)
+    def start(self):
+        if self.needs_rewrite:
+            self.queue.put({})
+        self.thread = threading.Thread(target=self.run, name="token-journal")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queues a user to be appended to the journal
+    # user  User JSON (must have a "token")
+    def append(self, user):
+        self.queue.put(user)
+
+    # Writes everything that is queued and stops the background writer
+    def stop(self):
+        if self.thread != None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    # Body of the background writer
+    def run(self):
+        running = True
+        while running:
+            users = [self.queue.get()]
+            if users[0] != None:
+                time.sleep(CONTROLLERS_CONFIG.TOKENS_JOURNAL_FLUSH_INTERVAL) # let more users queue up
+            while not self.queue.empty():
+                users.append(self.queue.get_nowait())
+            if None in users:
+                running = False
+            try:
+                self.write(list(filter(lambda user: user, users))) # skips None and the rewrite request ({})
+            except:
+                Log.error("Failed to write to the tokens journal {}".format(self.filename), exception=True)
+
+    # Appends users to the journal (one fsync), then compacts it if needed
+    # users  List of user JSONs
+    def write(self, users):
+        if len(users) > 0 and not self.needs_rewrite:
+            with open(self.filename, "a") as F:
+                for user in users:
+                    F.write(json.dumps(user) + "\n")
+                F.flush()
+                os.fsync(F.fileno())
+            self.num_lines += len(users)
+        for user in users:
+            self.users[user["token"]] = user
+        if self.needs_rewrite or self.num_lines > len(self.users) + CONTROLLERS_CONFIG.TOKENS_JOURNAL_MAX_STALE_LINES:
+            self.compact()
+
+    # Rewrites the journal with only the latest line of each token (atomically)
+    def compact(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as F:
+            for user in self.users.values():
+                F.write(json.dumps(user) + "\n")
+            F.flush()
+            os.fsync(F.fileno())
+        os.replace(temp_filename, self.filename)
+        self.num_lines = len(self.users)
+        self.needs_rewrite = False
+        Log.debug("Compacted the tokens journal {} ({} users)".format(self.filename, self.num_lines))
@@ -1,2 +1,6 @@
 from core.core import *
-from core.select_service import *
\ No newline at end of file
+from core.select_service import *
+from core.scheduler import *
+from core.profiler import *
+from core.state_bus import *
+from core.rate_limiter import *
\ No newline at end of file
@@ -4,8 +4,41 @@ from controllers import ControllersManager
 from things import Blueprint
 from logs import Log
 import time
-
-from core.select_service import SelectService
+import asyncio
+
+from core.select_service import SelectService, AsyncioBackend
+from core.scheduler import ThingScheduler, earliest_time
+from core.profiler import Profiler
+from core.state_bus import StateBus
+
+#
+# Keeps track of how much time the core loop spends idle (waiting for I/O or
+# timers) vs. busy
+#
+class LoopStats(object):
+    def __init__(self):
+        self.ticks = 0
+        self.skipped_passes = 0 # hardware/controllers update passes skipped because nothing happened
+        self.idle_time_s = 0.0
+        self.busy_time_s = 0.0
+
+    def on_tick(self, idle_time_s, busy_time_s):
+        self.ticks += 1
+        self.idle_time_s += idle_time_s
+        self.busy_time_s += busy_time_s
+
+    def get_idle_ratio(self):
+        total = self.idle_time_s + self.busy_time_s
+        return self.idle_time_s / total if total > 0 else 1.0
+
+    def to_json(self):
+        return {
+            "ticks": self.ticks,
+            "skipped_passes": self.skipped_passes,
+            "idle_s": self.idle_time_s,
+            "busy_s": self.busy_time_s,
+            "idle_ratio": self.get_idle_ratio(),
+        }
 
 class Core(object):
     def __init__(self):
@@ -13,8 +46,16 @@ class Core(object):
 
         self.cur_time_s = 0
 
+        # Publishes Thing state changes and schedules Thing updates (must exist before the Things are loaded)
+        self.state_bus = StateBus()
+        self.thing_scheduler = ThingScheduler(on_thing_updated=self.state_bus.mark_dirty)
+
         # Load blueprint of the building
         self.blueprint = Blueprint(self)
+        for thing in self.blueprint.get_things():
+            Profiler.instrument(thing, ["update", "get_state", "get_hardware_state"], "thing.{}".format(thing.id))
+            self.thing_scheduler.schedule_now(thing)
+            self.state_bus.mark_dirty(thing)
 
         # Initialize hardware manager (Arduino's and such...)
         self.hw_manager = HardwareManager(self)
@@ -22,41 +63,138 @@ class Core(object):
         # Initialize the controllers manager (tablets, phones, etc...)
         self.ctrl_manager = ControllersManager(self)
 
+        self.next_wakeup_time = ThingScheduler.ASAP # when timers (other than Things') need the core to update
+        self.last_dispatch_count = 0
+        self.loop_stats = LoopStats()
+        self.last_loop_stats = None
+        self.loop_stats_report_time = 0
+
     def update(self, cur_time_s):
         self.cur_time_s = cur_time_s
-
-        self.hw_manager.update(cur_time_s)
-        self.ctrl_manager.update(cur_time_s)
-
-        SelectService.perform_select(cur_time_s, select_writes=False) # only reads
-
-        self.hw_manager.update(cur_time_s)
-        self.ctrl_manager.update(cur_time_s)
-
-        SelectService.select_timeout = GENERAL_CONFIG.SELECT_TIMEOUT
-
-        need_reupdate = False
-        for thing in self.blueprint.get_things():
-            try:
-                need_reupdate = need_reupdate or thing.update(cur_time_s)
-            except:
-                Log.error("Thing {} failed to update".format(thing.id), exception=True)
-
-        if need_reupdate:
-            SelectService.select_timeout = 0 # this will make the select not wait so that Thing updates happen again shortly
-
-        self.hw_manager.update(cur_time_s)
-        self.ctrl_manager.update(cur_time_s)
-
+        tick_start = time.monotonic()
+        idle_before = SelectService.idle_time_s
+        if cur_time_s >= self.next_wakeup_time and self.next_wakeup_time != ThingScheduler.ASAP:
+            Profiler.record("core.loop_lag", cur_time_s - self.next_wakeup_time) # how late the core woke up for its timers
+
+        phase_start = Profiler.now()
+        num_dispatched = SelectService.perform_select(cur_time_s, select_writes=False) # only reads
+        num_dispatched += SelectService.dispatch_count - self.last_dispatch_count # events dispatched by an event loop between updates
+        self.last_dispatch_count = SelectService.dispatch_count
+        timers_due = cur_time_s >= self.next_wakeup_time
+        # time spent waiting is not part of the read phase
+        Profiler.record("core.read_select", Profiler.now() - phase_start - (SelectService.idle_time_s - idle_before))
+
+        # process input and timers (nothing can have changed otherwise)
+        if num_dispatched > 0 or timers_due:
+            self.update_managers(cur_time_s)
+        else:
+            self.loop_stats.skipped_passes += 1
+
+        phase_start = Profiler.now()
+        num_updated = self.thing_scheduler.update_due_things(cur_time_s)
+        phase_start = Profiler.record_since("core.things_update", phase_start)
+
+        # propagate changes to the hardware and controllers
+        if num_dispatched > 0 or num_updated > 0 or timers_due:
+            self.update_managers(cur_time_s, handle_commands=False) # the commands were handled in the first pass
+        else:
+            self.loop_stats.skipped_passes += 1
+
+        phase_start = Profiler.now()
         SelectService.perform_select(cur_time_s, select_reads=False) # only writes
+        Profiler.record_since("core.write_select", phase_start)
+
+        self.next_wakeup_time = self.get_next_wakeup_time(cur_time_s)
+        SelectService.select_timeout = min(GENERAL_CONFIG.SELECT_TIMEOUT, max(self.next_wakeup_time - cur_time_s, 0))
+
+        idle_time_s = SelectService.idle_time_s - idle_before
+        busy_time_s = time.monotonic() - tick_start - idle_time_s
+        Profiler.record("core.tick", busy_time_s)
+        self.loop_stats.on_tick(idle_time_s, busy_time_s)
+        self.report_loop_stats(cur_time_s)
+
+    # Runs a hardware manager pass and a controllers manager pass (timing each)
+    # cur_time_s       Current time in seconds
+    # handle_commands  Whether or not the controllers manager handles the queued commands
+    def update_managers(self, cur_time_s, handle_commands=True):
+        phase_start = Profiler.now()
+        self.hw_manager.update(cur_time_s)
+        phase_start = Profiler.record_since("core.hw_manager", phase_start)
+        self.ctrl_manager.update(cur_time_s, handle_commands)
+        Profiler.record_since("core.ctrl_manager", phase_start)
+
+    # Computes when the core needs to wake up next, regardless of I/O (Thing
+    # timers, throttled writes, serial sync timers, interface discovery, ...)
+    # cur_time_s  Current time in seconds
+    # returns     Time in seconds at which the core should update again
+    def get_next_wakeup_time(self, cur_time_s):
+        next_wakeup_time = earliest_time([
+            self.thing_scheduler.get_next_deadline(),
+            self.hw_manager.get_next_update_time(cur_time_s),
+            self.ctrl_manager.get_next_update_time(cur_time_s),
+        ])
+        if next_wakeup_time == None:
+            next_wakeup_time = cur_time_s + GENERAL_CONFIG.SELECT_TIMEOUT
+        return next_wakeup_time
+
+    # Periodically logs (and keeps) the idle-vs-busy statistics of the loop
+    # cur_time_s  Current time in seconds
+    def report_loop_stats(self, cur_time_s):
+        if cur_time_s >= self.loop_stats_report_time:
+            if self.loop_stats.ticks > 0:
+                self.last_loop_stats = self.loop_stats.to_json()
+                Log.debug("Core loop: {:.1f}% idle over {} ticks ({} update passes skipped)".format(
+                    self.loop_stats.get_idle_ratio() * 100, self.loop_stats.ticks, self.loop_stats.skipped_passes))
+            self.loop_stats = LoopStats()
+            self.loop_stats_report_time = cur_time_s + GENERAL_CONFIG.LOOP_STATS_INTERVAL
+
+    # returns  Idle-vs-busy statistics of the last reporting period (and the current one so far)
+    def get_loop_stats(self):
+        return {
+            "last": self.last_loop_stats,
+            "current": self.loop_stats.to_json(),
+        }
+
+    # returns  Loop statistics, timing histograms of the core phases and Things and statistics of the controllers
+    def get_stats(self):
+        return {
+            "loop": self.get_loop_stats(),
+            "profiler": Profiler.get_report(),
+            "controllers": self.ctrl_manager.get_stats(),
+            "origins": self.ctrl_manager.get_origin_stats(),
+        }
 
     # Main loop for the core (blocks execution)
     def run(self):
         Log.info("Running the core...")
         while True:
-            cur_time_s = time.time()
+            cur_time_s = time.monotonic()
             self.update(cur_time_s)
 
+    # Main loop for the core as an asyncio coroutine (never returns). The selectibles
+    # are watched by the event loop and the core is updated whenever one of them
+    # is dispatched, so the middleware can share a loop with other asyncio services
+    # e.g. loop.create_task(core.run_async())
+    async def run_async(self):
+        Log.info("Running the core on an asyncio event loop...")
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        SelectService.use_backend(AsyncioBackend(loop, time.monotonic, wakeup.set))
+        try:
+            while True:
+                wakeup.clear()
+                self.update(time.monotonic())
+                wait_start = time.monotonic()
+                if SelectService.select_timeout > 0:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), SelectService.select_timeout)
+                    except asyncio.TimeoutError: pass
+                else:
+                    await asyncio.sleep(0)
+                SelectService.idle_time_s += time.monotonic() - wait_start
+        finally:
+            SelectService.use_backend(None)
+
     def cleanup(self):
         self.hw_manager.cleanup()
         self.blueprint.cleanup()
@@ -0,0 +1,132 @@
+from config.general_config import GENERAL_CONFIG
+
+import time
+import bisect
+
+#
+# Histogram of durations with fixed buckets, so recording a duration is O(log(buckets))
+# and takes no extra memory no matter how many durations are recorded
+#
+class Histogram(object):
+    BUCKETS_MS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500] # upper bounds of the buckets
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BUCKETS_MS) + 1) # last bucket is for everything above the last bound
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    # duration_s  Duration to record in seconds
+    def record(self, duration_s):
+        duration_ms = duration_s * 1000.0
+        self.counts[bisect.bisect_left(Histogram.BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        if duration_ms > self.max_ms:
+            self.max_ms = duration_ms
+
+    # percentile  Percentile to estimate (0-100)
+    # returns     Upper bound of the bucket the percentile falls in (in ms)
+    def get_percentile(self, percentile):
+        target = self.count * percentile / 100.0
+        seen = 0
+        for i in range(len(self.counts)):
+            seen += self.counts[i]
+            if seen >= target and seen > 0:
+                return Histogram.BUCKETS_MS[i] if i < len(Histogram.BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def to_json(self):
+        buckets = {}
+        for i in range(len(self.counts)):
+            if self.counts[i] > 0:
+                label = "<={}".format(Histogram.BUCKETS_MS[i]) if i < len(Histogram.BUCKETS_MS) else ">{}".format(Histogram.BUCKETS_MS[-1])
+                buckets[label] = self.counts[i]
+        return {
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.get_percentile(50),
+            "p99_ms": self.get_percentile(99),
+            "buckets": buckets,
+        }
+
+#
+# Always-on timing of the core loop phases and of the Things. Durations are
+# recorded into named histograms that can be queried at runtime
+#
+class Profiler(object):
+    histograms = {} # name -> Histogram
+
+    # name     Name of the histogram
+    # returns  The histogram with the given name (created if needed)
+    @staticmethod
+    def get_histogram(name):
+        histogram = Profiler.histograms.get(name, None)
+        if histogram == None:
+            histogram = Profiler.histograms[name] = Histogram()
+        return histogram
+
+    # Records a duration
+    # name        Name of the histogram to record into
+    # duration_s  Duration in seconds
+    @staticmethod
+    def record(name, duration_s):
+        if GENERAL_CONFIG.PROFILING:
+            Profiler.get_histogram(name).record(duration_s)
+
+    # Records the time elapsed since a given start time
+    # name     Name of the histogram to record into
+    # start    Start time (from Profiler.now())
+    # returns  The current time (so it can be used as the start of the next measurement)
+    @staticmethod
+    def record_since(name, start):
+        now = time.perf_counter()
+        Profiler.record(name, now - start)
+        return now
+
+    # returns  Current time to be used with record_since
+    @staticmethod
+    def now():
+        return time.perf_counter()
+
+    # Wraps methods of an object so that every call to them is timed
+    # obj           Object whose methods are timed
+    # method_names  Names of the methods to time
+    # prefix        Prefix of the histogram names (histogram is named <prefix>.<method name>)
+    @staticmethod
+    def instrument(obj, method_names, prefix):
+        if not GENERAL_CONFIG.PROFILING:
+            return
+        for method_name in method_names:
+            setattr(obj, method_name, Profiler.timed(getattr(obj, method_name), "{}.{}".format(prefix, method_name)))
+
+    # function  Function to time
+    # name      Name of the histogram to record into
+    # returns   A function that calls the given function and times it
+    @staticmethod
+    def timed(function, name):
+        histogram = Profiler.get_histogram(name)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - start)
+        return timed_function
+
+    # prefix   Only report histograms whose name starts with this prefix (None for all)
+    # returns  JSON-serializable report of the histograms
+    @staticmethod
+    def get_report(prefix=None):
+        report = {}
+        for name in sorted(Profiler.histograms.keys()):
+            if prefix == None or name.startswith(prefix):
+                report[name] = Profiler.histograms[name].to_json()
+        return report
+
+    # Clears all recorded durations
+    @staticmethod
+    def reset():
+        for histogram in Profiler.histograms.values():
+            histogram.__init__()
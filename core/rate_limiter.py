@@ -0,0 +1,51 @@
+#
+# Token bucket used to shape the throughput of a selectible: tokens (bytes)
+# accumulate at a fixed rate up to a burst size, and sending consumes them.
+# All operations are O(1) regardless of how many sends happened recently.
+#
+class TokenBucket(object):
+    # rate   Number of tokens added per second
+    # burst  Maximum number of tokens that can accumulate
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_time_s = None # time of the last refill
+        self.throttle_count = 0 # number of times it ran out of tokens
+
+    # Adds the tokens accumulated since the last refill
+    # cur_time_s  Current time in seconds
+    def refill(self, cur_time_s):
+        if self.last_time_s != None and cur_time_s > self.last_time_s:
+            self.tokens = min(float(self.burst), self.tokens + (cur_time_s - self.last_time_s) * self.rate)
+        if self.last_time_s == None or cur_time_s > self.last_time_s:
+            self.last_time_s = cur_time_s
+
+    # cur_time_s  Current time in seconds
+    # returns     Number of whole tokens that can be consumed now
+    def get_available(self, cur_time_s):
+        self.refill(cur_time_s)
+        return int(self.tokens)
+
+    # count       Number of tokens to consume
+    # cur_time_s  Current time in seconds
+    def consume(self, count, cur_time_s):
+        self.refill(cur_time_s)
+        self.tokens -= count
+        if self.tokens < 1:
+            self.throttle_count += 1
+
+    # count       Number of tokens needed (at most burst tokens are waited for)
+    # cur_time_s  Current time in seconds
+    # returns     Time at which count tokens will be available
+    def get_available_time(self, count, cur_time_s):
+        self.refill(cur_time_s)
+        count = min(count, self.burst)
+        if self.tokens >= count:
+            return cur_time_s
+        return cur_time_s + (count - self.tokens) / self.rate
+
+    # cur_time_s  Current time in seconds
+    # returns     Whether or not there are no tokens left
+    def is_throttling(self, cur_time_s):
+        return self.get_available(cur_time_s) == 0
@@ -0,0 +1,81 @@
+from logs import Log
+
+import heapq
+
+# times  List of times (in seconds), some of which can be None
+# returns  The earliest of the given times, None if all of them are None
+def earliest_time(times):
+    times = list(filter(lambda t: t != None, times))
+    return min(times) if len(times) > 0 else None
+
+#
+# Deadline-driven scheduler for Thing updates. Instead of updating every Thing
+# on every tick, a Thing is updated when something happens to it (a command,
+# a hardware input, ...) or when the deadline it declared (through
+# Thing.get_next_update_time) is due.
+#
+class ThingScheduler(object):
+    ASAP = float("-inf") # deadline of Things that should be updated on the next tick
+
+    # on_thing_updated  Function called with every Thing after it is updated (can be None)
+    def __init__(self, on_thing_updated=None):
+        self.on_thing_updated = on_thing_updated
+        self.deadlines = {} # Thing id -> (deadline, sequence) of the Thing's live heap entry
+        self.heap = [] # heap of (deadline, sequence, Thing) (entries not in self.deadlines are stale)
+        self.sequence = 0
+        self.updating_thing = None # Thing currently being updated
+
+    # Schedules a Thing to be updated at a given time. If the Thing is already
+    # scheduled earlier, the earlier deadline is kept
+    # thing     Thing to update
+    # deadline  Time (in seconds) at which the Thing needs to be updated
+    def schedule(self, thing, deadline):
+        current = self.deadlines.get(thing.id, None)
+        if current != None and current[0] <= deadline:
+            return
+        self.sequence += 1
+        self.deadlines[thing.id] = (deadline, self.sequence)
+        heapq.heappush(self.heap, (deadline, self.sequence, thing))
+
+    # Schedules a Thing to be updated on the next tick
+    # thing  Thing to update
+    def schedule_now(self, thing):
+        if thing != self.updating_thing: # a Thing changing itself in its update() is already updated
+            self.schedule(thing, ThingScheduler.ASAP)
+
+    # returns  The earliest deadline of all scheduled Things, None if nothing is scheduled
+    def get_next_deadline(self):
+        while len(self.heap) > 0:
+            (deadline, sequence, thing) = self.heap[0]
+            if self.deadlines.get(thing.id, None) == (deadline, sequence):
+                return deadline
+            heapq.heappop(self.heap) # stale entry
+        return None
+
+    # Updates all the Things that are due and reschedules them
+    # cur_time_s  Current time in seconds
+    # returns     Number of Things updated
+    def update_due_things(self, cur_time_s):
+        due_things = []
+        while len(self.heap) > 0 and self.heap[0][0] <= cur_time_s:
+            (deadline, sequence, thing) = heapq.heappop(self.heap)
+            if self.deadlines.get(thing.id, None) == (deadline, sequence):
+                del self.deadlines[thing.id]
+                due_things.append(thing)
+
+        for thing in due_things:
+            self.updating_thing = thing
+            next_update_time = None
+            try:
+                if thing.update(cur_time_s):
+                    next_update_time = cur_time_s # legacy Things that need another update ASAP
+                else:
+                    next_update_time = thing.get_next_update_time(cur_time_s)
+            except:
+                Log.error("Thing {} failed to update".format(thing.id), exception=True)
+            self.updating_thing = None
+            if self.on_thing_updated:
+                self.on_thing_updated(thing)
+            if next_update_time != None:
+                self.schedule(thing, next_update_time)
+        return len(due_things)
@@ -1,8 +1,13 @@
+from config.general_config import GENERAL_CONFIG
+from core.rate_limiter import TokenBucket
 from logs import Log
 
 import sys
-import select
-from functools import reduce
+import ssl
+import time
+import socket
+import selectors
+from collections import deque
 
 #
 # Base class for a "selectible" object, which can read/write using the SelectService
@@ -10,124 +15,377 @@ from functools import reduce
 # Selectibles should use write_to_fd to write to the fd (never use plain .write!)
 #
 class Selectible(object):
+    MAX_WRITE_CHUNKS = 64 # maximum number of chunks written in one sendmsg call
+
     def initialize_selectible_fd(self, fd):
-        self.pending_write_to_fd = bytearray([])
+        self.pending_write_chunks = deque() # memoryviews of the bytes waiting to be written (in order)
+        self.pending_write_size = 0 # total number of bytes in pending_write_chunks
         self.fd = fd
         self.write_function = "write" if "write" in dir(fd) else "send" # some have .write, some have .send
-        self.max_bytes_per_unit_time = 0
-        self.unit_time_seconds = 1
-        self.recent_sent_history = [] # list of (num_sent, timestamp)
+        # plain sockets can write many chunks at once without joining them (TLS sockets don't support sendmsg)
+        self.use_sendmsg = isinstance(fd, socket.socket) and not isinstance(fd, ssl.SSLSocket) and hasattr(fd, "sendmsg")
+        self.rate_limiter = None # TokenBucket limiting the bytes written per second (None if unlimited)
         SelectService.register_selectible(self)
 
+    # Limits the throughput of the writes to the fd
+    # rate   Maximum number of bytes written per second
+    # burst  Maximum number of bytes written at once after being idle
+    def set_rate_limit(self, rate, burst):
+        self.rate_limiter = TokenBucket(rate, burst)
+
     def destroy_selectible(self):
         last_len = 0
-        while len(self.pending_write_to_fd) > 0 and last_len != len(self.pending_write_to_fd):
+        while self.pending_write_size > 0 and last_len != self.pending_write_size:
+            last_len = self.pending_write_size
             self.on_write_ready(0)
-            last_len = len(self.pending_write_to_fd)
         SelectService.deregister_selectible(self)
 
+    # Queues bytes to be written to the fd when it is ready (the bytes are not copied
+    # if they are immutable, so they must not be modified afterwards)
+    # data  bytes or bytearray to write
     def write_to_fd(self, data):
-        self.pending_write_to_fd += data
+        if len(data) == 0:
+            return
+        was_empty = self.pending_write_size == 0
+        self.pending_write_chunks.append(memoryview(data if type(data) is bytes else bytes(data)))
+        self.pending_write_size += len(data)
+        if was_empty:
+            SelectService.set_write_interest(self, True)
 
     def on_read_ready(self, cur_time_s):
         pass
 
-    def get_max_send_size(self, cur_time_s):
-        if self.max_bytes_per_unit_time > 0:
-            while len(self.recent_sent_history) > 0 and cur_time_s - self.recent_sent_history[0][1] > self.unit_time_seconds:
-                # too old, remove from history list
-                self.recent_sent_history = self.recent_sent_history[1:]
-            total_sent_in_last_sec = reduce(lambda a,b: a + b, map(lambda rsh: rsh[0], self.recent_sent_history), 0)
-            return min(max(self.max_bytes_per_unit_time - total_sent_in_last_sec, 0), len(self.pending_write_to_fd))
-        return len(self.pending_write_to_fd)
+    # returns  Number of bytes waiting to be written to the fd
+    def get_pending_write_size(self):
+        return self.pending_write_size
+
+    # cur_time_s  Current time in seconds
+    # returns     Time at which throttled pending bytes can be sent (when the rate limiter has
+    #             enough bytes for all of them or a full burst), None if nothing is waiting on
+    #             the rate limiter (writability is left to the select)
+    def get_next_write_time(self, cur_time_s):
+        if self.pending_write_size > 0 and self.rate_limiter != None:
+            next_time = self.rate_limiter.get_available_time(self.pending_write_size, cur_time_s)
+            if next_time > cur_time_s:
+                return next_time
+        return None
 
+    # cur_time_s  Current time in seconds
+    # returns     Number of pending bytes that can be written now
+    def get_max_send_size(self, cur_time_s):
+        if self.rate_limiter != None:
+            return min(self.rate_limiter.get_available(cur_time_s), self.pending_write_size)
+        return self.pending_write_size
 
     def on_sent(self, nsent, cur_time_s):
-        if self.max_bytes_per_unit_time > 0:
-            self.recent_sent_history.append((nsent, cur_time_s))
+        if self.rate_limiter != None:
+            self.rate_limiter.consume(nsent, cur_time_s)
+
+    # returns  Whether or not pending bytes are held back by the rate limiter
+    def is_write_throttled(self):
+        return SelectService.throttled_selectibles.get(getattr(self, "registered_fileno", None), None) == self
+
+    # max_bytes  Maximum number of bytes to return
+    # returns    List of the first pending chunks (the last one cut) holding at most max_bytes bytes
+    def get_write_chunks(self, max_bytes):
+        chunks = []
+        for chunk in self.pending_write_chunks:
+            if max_bytes <= 0 or len(chunks) >= Selectible.MAX_WRITE_CHUNKS:
+                break
+            if len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes]
+            chunks.append(chunk)
+            max_bytes -= len(chunk)
+        return chunks
+
+    # Removes written bytes from the pending chunks (without copying the rest)
+    # nsent  Number of bytes written
+    def consume_written(self, nsent):
+        self.pending_write_size -= nsent
+        while nsent > 0:
+            chunk = self.pending_write_chunks[0]
+            if len(chunk) <= nsent:
+                self.pending_write_chunks.popleft()
+                nsent -= len(chunk)
+            else:
+                self.pending_write_chunks[0] = chunk[nsent:]
+                nsent = 0
 
     def on_write_ready(self, cur_time_s):
         try:
-            # call the write function
             nsend = self.get_max_send_size(cur_time_s)
-            if nsend > 0:
-                nsent = getattr(self.fd, self.write_function)(self.pending_write_to_fd[:nsend])
+            if nsend == 0 and self.pending_write_size > 0:
+                # out of bytes: stop selecting for writes until the rate limiter refills
+                SelectService.throttle_writes(self)
+            elif nsend > 0:
+                chunks = self.get_write_chunks(nsend)
+                if self.use_sendmsg:
+                    nsent = self.fd.sendmsg(chunks)
+                else:
+                    # call the write function (only one buffer can be written, join the chunks if needed)
+                    nsent = getattr(self.fd, self.write_function)(chunks[0] if len(chunks) == 1 else b"".join(chunks))
                 if nsent == None:
-                    Log.error("Failed to call {} on fd {} (returned None, buffer {})".format(self.write_function, self.fd, self.pending_write_to_fd[:nsend]))
+                    Log.error("Failed to call {} on fd {} (returned None, {} bytes)".format(self.write_function, self.fd, nsend))
+                    return True
                 elif nsent <= 0:
                     Log.debug("Selectible::on_write_ready() wrote 0 bytes")
                     return False
-                self.pending_write_to_fd = self.pending_write_to_fd[nsent:]
+                self.consume_written(nsent)
                 self.on_sent(nsent, cur_time_s)
+                if self.pending_write_size == 0:
+                    SelectService.set_write_interest(self, False)
             return True
+        except (BlockingIOError, InterruptedError, ssl.SSLWantWriteError):
+            return True # try again when the fd is writable
         except:
             Log.debug("Selectible::on_write_ready() failed.", exception=True)
             return False
 
 #
-# A simple select-based event pump
+# Event backend built on the selectors module. Selectibles are registered once
+# for reading, and only hold write interest while they have pending bytes, so
+# a select costs O(ready fds) instead of rebuilding the fd lists every call.
+#
+class SelectorsBackend(object):
+    # name of the backend -> name of the class in the selectors module
+    BACKENDS = {
+        "epoll": "EpollSelector",
+        "kqueue": "KqueueSelector",
+        "devpoll": "DevpollSelector",
+        "poll": "PollSelector",
+        "select": "SelectSelector",
+    }
+
+    def __init__(self, backend="auto"):
+        selector_class = SelectorsBackend.get_selector_class(backend)
+        # selector of all registered selectibles (read interest) and selector of
+        # selectibles that have pending writes (write interest). They are kept
+        # separate so that reads and writes can be selected on independently.
+        self.read_selector = selector_class()
+        self.write_selector = selector_class()
+        Log.info("Using select backend {}".format(selector_class.__name__))
+
+    # backend  Name of the backend (see BACKENDS), or "auto"
+    # returns  The selectors class to use
+    @staticmethod
+    def get_selector_class(backend):
+        if backend in SelectorsBackend.BACKENDS:
+            selector_class = getattr(selectors, SelectorsBackend.BACKENDS[backend], None)
+            if selector_class:
+                return selector_class
+            Log.warning("Select backend {} is not available on this system, using the default".format(backend))
+        elif backend != "auto":
+            Log.warning("Unknown select backend {}, using the default".format(backend))
+        return selectors.DefaultSelector
+
+    def register(self, selectible):
+        self.read_selector.register(selectible.registered_fileno, selectors.EVENT_READ, selectible)
+
+    def unregister(self, selectible):
+        self.set_write_interest(selectible, False)
+        try:
+            self.read_selector.unregister(selectible.registered_fileno)
+        except (KeyError, ValueError): pass
+
+    def set_write_interest(self, selectible, interested):
+        key = selectible.registered_fileno
+        is_registered = key in self.write_selector.get_map()
+        try:
+            if interested and not is_registered:
+                self.write_selector.register(key, selectors.EVENT_WRITE, selectible)
+            elif not interested and is_registered:
+                self.write_selector.unregister(key)
+        except (KeyError, ValueError):
+            Log.debug("SelectorsBackend::set_write_interest() failed", exception=True)
+
+    # Waits for selectibles to be ready
+    # timeout        Maximum time to block in seconds
+    # select_reads   Whether or not to wait for reads
+    # select_writes  Whether or not to wait for writes
+    # returns        A tuple (list of selectibles ready to read, list of selectibles ready to write)
+    def select(self, timeout, select_reads, select_writes):
+        select_writes = select_writes and len(self.write_selector.get_map()) > 0
+        ready_writes = []
+        ready_reads = []
+        if select_writes:
+            # only block on writes if not waiting on reads too
+            ready_writes = self.write_selector.select(timeout if not select_reads else 0)
+        if select_reads:
+            ready_reads = self.read_selector.select(timeout if len(ready_writes) == 0 else 0)
+        return (list(map(lambda kv: kv[0].data, ready_reads)), list(map(lambda kv: kv[0].data, ready_writes)))
+
+#
+# Event backend that lets an asyncio event loop watch the selectibles (using
+# loop.add_reader/loop.add_writer) so the middleware can share a loop with
+# other asyncio services. Readiness is dispatched by the loop itself, so
+# selecting is a no-op.
+#
+class AsyncioBackend(object):
+    # loop      asyncio event loop
+    # get_time  Function that returns the current time in seconds
+    # on_event  Function called after every dispatched event (can be None)
+    def __init__(self, loop, get_time, on_event=None):
+        self.loop = loop
+        self.get_time = get_time
+        self.on_event = on_event
+        self.writers = set() # filenos currently watched for writing
+
+    def register(self, selectible):
+        self.loop.add_reader(selectible.registered_fileno, self.on_ready, selectible, "on_read_ready")
+
+    def unregister(self, selectible):
+        self.set_write_interest(selectible, False)
+        self.loop.remove_reader(selectible.registered_fileno)
+
+    def set_write_interest(self, selectible, interested):
+        key = selectible.registered_fileno
+        if interested and key not in self.writers:
+            self.writers.add(key)
+            self.loop.add_writer(key, self.on_ready, selectible, "on_write_ready")
+        elif not interested and key in self.writers:
+            self.writers.remove(key)
+            self.loop.remove_writer(key)
+
+    def select(self, timeout, select_reads, select_writes):
+        return ([], [])
+
+    # Called by the event loop when a selectible is ready
+    def on_ready(self, selectible, callback_name):
+        SelectService.dispatch(selectible, getattr(selectible, callback_name), self.get_time())
+        if self.on_event:
+            self.on_event()
+
+#
+# A simple event pump for selectibles using a pluggable event backend
 #
 class SelectService(object):
-    # a dictionary of selectible-string -> selectible
+    # a dictionary of fileno -> selectible
     selectibles = {}
 
     select_timeout = 0
 
+    idle_time_s = 0.0 # total time spent blocked waiting for I/O
+    dispatch_count = 0 # total number of readiness events dispatched
+
+    # Event backend (SelectorsBackend or AsyncioBackend)
+    backend = None
+
+    # a dictionary of fileno -> selectible whose writes are held back by its rate limiter
+    throttled_selectibles = {}
+
+    # Returns the backend in use (creates the default backend if none is set)
+    @staticmethod
+    def get_backend():
+        if SelectService.backend == None:
+            SelectService.backend = SelectorsBackend(GENERAL_CONFIG.SELECT_BACKEND)
+        return SelectService.backend
+
+    # Switches to a different event backend, moving all registered selectibles to it
+    # backend  New backend to use (None to use the default backend)
+    @staticmethod
+    def use_backend(backend):
+        selectibles = list(SelectService.selectibles.values())
+        if SelectService.backend != None:
+            for selectible in selectibles:
+                SelectService.backend.unregister(selectible)
+        SelectService.backend = backend
+        for selectible in selectibles:
+            SelectService.get_backend().register(selectible)
+            if selectible.pending_write_size > 0:
+                SelectService.get_backend().set_write_interest(selectible, True)
+
     # Registers a selectible
     # selectible  A Selectible object
     @staticmethod
     def register_selectible(selectible):
         Log.info("registered selectible {}".format(str(selectible)))
-        SelectService.selectibles[selectible.fd.fileno()] = selectible
+        key = selectible.fd.fileno()
+        if key in SelectService.selectibles: # a stale selectible whose fd got reused
+            SelectService.deregister_selectible(SelectService.selectibles[key])
+        selectible.registered_fileno = key
+        SelectService.selectibles[key] = selectible
+        SelectService.get_backend().register(selectible)
+        if selectible.pending_write_size > 0:
+            SelectService.set_write_interest(selectible, True)
 
     # Deregisters a selectible
     @staticmethod
     def deregister_selectible(selectible):
         Log.info("DEregistered selectible {}".format(str(selectible)))
-        key = selectible.fd.fileno()
-        if key in SelectService.selectibles:
+        key = getattr(selectible, "registered_fileno", None)
+        if key in SelectService.selectibles and SelectService.selectibles[key] == selectible:
+            SelectService.get_backend().unregister(selectible)
             del SelectService.selectibles[key]
+            SelectService.throttled_selectibles.pop(key, None)
 
-    # Performs a select with a timeout to wait for selectibles to be ready for reading or writing
-    # cur_time_s  Current time in seconds
+    # Adds or removes a selectible from the selectibles waiting to write
+    # selectible  A registered Selectible object
+    # interested  Whether or not the selectible has bytes to write
     @staticmethod
-    def perform_select(cur_time_s, select_reads=True, select_writes=True):
-        all_selectibles = SelectService.selectibles.values()
+    def set_write_interest(selectible, interested):
+        key = getattr(selectible, "registered_fileno", None)
+        if SelectService.selectibles.get(key, None) == selectible:
+            SelectService.get_backend().set_write_interest(selectible, interested)
 
-        read_descriptors = []
-        write_descriptors = []
+    # Stops selecting a selectible for writes until its rate limiter allows writing again
+    # (the core wakes up at the selectible's get_next_write_time)
+    # selectible  A registered Selectible object
+    @staticmethod
+    def throttle_writes(selectible):
+        key = getattr(selectible, "registered_fileno", None)
+        if SelectService.selectibles.get(key, None) == selectible and key not in SelectService.throttled_selectibles:
+            Log.debug("Throttling writes to {} ({} bytes pending)".format(str(selectible), selectible.pending_write_size))
+            SelectService.throttled_selectibles[key] = selectible
+            SelectService.get_backend().set_write_interest(selectible, False)
 
-        if select_reads:
-            readable_descriptors = dict(map(lambda s: (s.fd.fileno(), s), all_selectibles))
-            read_descriptors = list(map(lambda rd: rd.fd, readable_descriptors.values()))
+    # Selects the throttled selectibles for writes again once their rate limiter allows it
+    # cur_time_s  Current time in seconds
+    @staticmethod
+    def resume_throttled_writes(cur_time_s):
+        for (key, selectible) in list(SelectService.throttled_selectibles.items()):
+            next_time = selectible.get_next_write_time(cur_time_s)
+            if next_time == None or next_time <= cur_time_s:
+                del SelectService.throttled_selectibles[key]
+                if selectible.pending_write_size > 0:
+                    SelectService.get_backend().set_write_interest(selectible, True)
 
-        if select_writes:
-            writable_descriptors = dict(map(lambda s: (s.fd.fileno(), s), filter(lambda s: len(s.pending_write_to_fd) > 0, all_selectibles)))
-            write_descriptors = list(map(lambda wd: wd.fd, writable_descriptors.values()))
+    # Calls a readiness callback on a selectible and destroys the selectible if it fails
+    # selectible  Selectible that is ready
+    # callback    Readiness function to call on the selectible (on_read_ready or on_write_ready)
+    # cur_time_s  Current time in seconds
+    @staticmethod
+    def dispatch(selectible, callback, cur_time_s):
+        if SelectService.selectibles.get(selectible.registered_fileno, None) != selectible:
+            return # destroyed while dispatching an earlier event
+        SelectService.dispatch_count += 1
+        try:
+            keep = callback(cur_time_s)
+        except:
+            keep = False
+        if not keep:
+            selectible.destroy_selectible()
 
-        if len(read_descriptors) + len(write_descriptors) == 0:
-            return # nothing to select
+    # Performs a select with a timeout to wait for selectibles to be ready for reading or writing
+    # cur_time_s  Current time in seconds
+    # returns     Number of selectibles dispatched
+    @staticmethod
+    def perform_select(cur_time_s, select_reads=True, select_writes=True):
+        if len(SelectService.selectibles) == 0:
+            return 0 # nothing to select
 
+        (ready_reads, ready_writes) = ([], [])
         try:
-            (ready_read_descriptors, ready_write_descriptors, _) = select.select(read_descriptors, write_descriptors, [], SelectService.select_timeout)
-            for D in ready_write_descriptors:
-                fd = D.fileno()
-                try:
-                    keep = writable_descriptors[fd].on_write_ready(cur_time_s)
-                except:
-                    keep = False
-                if not keep:
-                    writable_descriptors[fd].destroy_selectible()
-            for D in ready_read_descriptors:
-                fd = D.fileno()
-                try:
-                    keep = readable_descriptors[fd].on_read_ready(cur_time_s)
-                except:
-                    keep = False
-                if not keep:
-                    readable_descriptors[fd].destroy_selectible()
+            if select_writes and len(SelectService.throttled_selectibles) > 0:
+                SelectService.resume_throttled_writes(cur_time_s)
+            select_start = time.monotonic()
+            (ready_reads, ready_writes) = SelectService.get_backend().select(SelectService.select_timeout, select_reads, select_writes)
+            SelectService.idle_time_s += time.monotonic() - select_start
+            for selectible in ready_writes:
+                SelectService.dispatch(selectible, selectible.on_write_ready, cur_time_s)
+            for selectible in ready_reads:
+                SelectService.dispatch(selectible, selectible.on_read_ready, cur_time_s)
         except KeyboardInterrupt:
             raise
         except:
             Log.debug("Select failed.", exception=True)
-
+        return len(ready_reads) + len(ready_writes)
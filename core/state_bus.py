@@ -0,0 +1,131 @@
+from config.general_config import GENERAL_CONFIG
+from logs import Log
+
+import random
+from collections import deque
+
+#
+# In-process bus of Thing state changes. Things are marked dirty whenever
+# something happens to them (see Thing.mark_dirty) and the bus is flushed
+# before the controllers are updated: only the dirty Things are asked for
+# their state, and only the ones whose state actually changed are published
+# to the subscribers (e.g. controllers). This way controllers don't need to
+# scan all the Things on every update.
+#
+class StateBus(object):
+    def __init__(self):
+        self.dirty_things = {} # Thing id -> Thing that might have changed since the last flush
+        self.states = {} # Thing id -> last published state of the Thing (including the change token)
+        self.versions = {} # Thing id -> state_version of the last published state
+        self.subscribers = set() # functions called with the IDs of all the Things that changed
+        self.thing_subscribers = {} # Thing id -> set of functions called when that Thing changes
+        self.subscriptions = {} # subscribed function -> set of Thing ids it is subscribed to (None for all)
+        self.version = 0 # incremented whenever a flush publishes changes
+        self.boot_id = "{:08x}".format(random.getrandbits(32)) # tells resume tokens of this run apart from older runs
+        self.sequence = 0 # number of changes published so far
+        self.change_log = deque(maxlen=GENERAL_CONFIG.STATE_CHANGE_LOG_SIZE) # (sequence, Thing id) of the most recent changes
+
+    # Marks a Thing as possibly changed
+    # thing  The Thing that might have changed
+    def mark_dirty(self, thing):
+        self.dirty_things[thing.id] = thing
+
+    # Subscribes to state changes (replacing any previous subscription of the same function)
+    # callback   Function to call with the list of Thing ids whose state changed
+    # thing_ids  IDs of the Things to get changes of (None for all the Things)
+    def subscribe(self, callback, thing_ids=None):
+        self.unsubscribe(callback)
+        if thing_ids == None:
+            self.subscribers.add(callback)
+        else:
+            thing_ids = set(thing_ids)
+            for thing_id in thing_ids:
+                self.thing_subscribers.setdefault(thing_id, set()).add(callback)
+        self.subscriptions[callback] = thing_ids
+
+    # callback  A function previously subscribed
+    def unsubscribe(self, callback):
+        if callback not in self.subscriptions:
+            return
+        thing_ids = self.subscriptions.pop(callback)
+        if thing_ids == None:
+            self.subscribers.discard(callback)
+        else:
+            for thing_id in thing_ids:
+                callbacks = self.thing_subscribers[thing_id]
+                callbacks.discard(callback)
+                if len(callbacks) == 0:
+                    del self.thing_subscribers[thing_id]
+
+    # thing_id  ID of the Thing
+    # returns   Last published state of the Thing (must not be modified), None if not published
+    def get_state(self, thing_id):
+        return self.states.get(thing_id, None)
+
+    # thing_id  ID of the Thing
+    # returns   Version of the last published state of the Thing, None if not published
+    def get_version(self, thing_id):
+        return self.versions.get(thing_id, None)
+
+    # returns  IDs of all the Things with a published state
+    def get_thing_ids(self):
+        return self.states.keys()
+
+    # returns  A token identifying the current point in the change log
+    def get_resume_token(self):
+        return "{}:{}".format(self.boot_id, self.sequence)
+
+    # resume_token  A token from get_resume_token()
+    # returns       Set of IDs of the Things changed since the token was handed out, None
+    #               if the token is invalid or too old (the change log wrapped around)
+    def get_changes_since(self, resume_token):
+        try:
+            (boot_id, sequence) = resume_token.split(":")
+            sequence = int(sequence)
+        except:
+            return None
+        if boot_id != self.boot_id or sequence > self.sequence or sequence < self.sequence - len(self.change_log):
+            return None
+
+        changed = set()
+        for (change_sequence, thing_id) in reversed(self.change_log):
+            if change_sequence <= sequence:
+                break
+            changed.add(thing_id)
+        return changed
+
+    # Publishes the changes of the dirty Things to the subscribers
+    # returns  List of IDs of the Things whose state changed
+    def flush(self):
+        if len(self.dirty_things) == 0:
+            return []
+
+        dirty_things = self.dirty_things
+        self.dirty_things = {}
+        changed = []
+        for thing in dirty_things.values():
+            try:
+                state = thing.get_state()
+                state["token"] = thing.last_change_token
+            except:
+                Log.error("StateBus::flush() failed to get the state of {}".format(thing.id), exception=True)
+                continue
+            if self.states.get(thing.id, None) != state:
+                self.states[thing.id] = state
+                thing.state_version += 1
+                self.versions[thing.id] = thing.state_version
+                changed.append(thing.id)
+
+        if len(changed) > 0:
+            self.version += 1
+            for thing_id in changed:
+                self.sequence += 1
+                self.change_log.append((self.sequence, thing_id))
+            # only notify the subscribers interested in the changed Things
+            changes = dict(map(lambda callback: (callback, changed), self.subscribers))
+            for thing_id in changed:
+                for callback in self.thing_subscribers.get(thing_id, ()):
+                    changes.setdefault(callback, []).append(thing_id)
+            for (callback, thing_ids) in changes.items():
+                callback(thing_ids)
+        return changed
@@ -1,4 +1,5 @@
 from hardware.controller_base import HardwareController
+from core.scheduler import earliest_time
 from logs import Log
 
 import struct
@@ -139,8 +140,7 @@ class ArduinoController(HardwareController):
         self.is_initialized = False
         self.total_bytes_received = 0
         super(ArduinoController, self).__init__(hw_manager, comport, baud=9600, fake_serial_port=fake_serial_port)
-        self.max_bytes_per_unit_time = 63
-        self.unit_time_seconds = 0.5
+        self.set_rate_limit(126, 63) # 63 bytes per 0.5 seconds
 
     # Initializes the Things that this controller controls
     def initialize_board(self):
@@ -293,6 +293,18 @@ class ArduinoController(HardwareController):
 
         return True
 
+    # returns  Times at which the sync state needs attention (sync sequence sending and receive timeout)
+    def get_sync_times(self):
+        times = []
+        if self.receive_timeout >= 0:
+            times.append(self.receive_timeout)
+        if self.total_bytes_received > 0:
+            times.append(self.sync_send_timer)
+        return times
+
+    def get_next_update_time(self, cur_time_s):
+        return earliest_time([super(ArduinoController, self).get_next_update_time(cur_time_s)] + self.get_sync_times())
+
     def set_port_value(self, port, value):
         super(ArduinoController, self).set_port_value(port, value)
         if self.is_in_sync():
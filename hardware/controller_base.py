@@ -65,6 +65,11 @@ class HardwareController(Selectible):
             return False
         return True
 
+    # cur_time_s  Current time in seconds
+    # returns     Time at which this device needs to be updated regardless of I/O, None if never
+    def get_next_update_time(self, cur_time_s):
+        return self.get_next_write_time(cur_time_s)
+
     # Sends a command to the controller to set a port to a certain output value
     def set_port_value(self, port, value):
         Log.hammoud("HardwareController::set_port_value({}, {})".format(port, value))
@@ -1,6 +1,7 @@
 from config.hardware_config import HARDWARE_CONFIG
 from hardware.arduino_controller import ArduinoController
 from hardware.zigbee_controller import ZigbeeController
+from core.scheduler import earliest_time
 from logs import Log
 
 import time
@@ -60,6 +61,11 @@ class HardwareManager(object):
             if not keep:
                 controller.destroy_selectible()
 
+    # cur_time_s  Current time in seconds
+    # returns     Time at which this manager needs to be updated regardless of I/O, None if never
+    def get_next_update_time(self, cur_time_s):
+        return earliest_time([self.update_timer] + list(map(lambda c: c.get_next_update_time(cur_time_s), self.connected_controllers.values())))
+
     # Called when this manager needs to free all its resources
     def cleanup(self):
         # detach all devices
@@ -19,6 +19,7 @@
 from hardware.controller_base import HardwareController
 from hardware.arduino_controller import ArduinoController, ArduinoProtocol
 from things.blueprint import RemoteBoard
+from core.scheduler import earliest_time
 from logs import Log
 
 import struct
@@ -48,8 +49,7 @@ class RemoteZigbee(ArduinoController):
         
         self.num_allowed_halves = 0
         self.total_bytes_received = 0
-        self.max_bytes_per_unit_time = 63
-        self.unit_time_seconds = 0.5
+        self.set_rate_limit(126, 63) # 63 bytes per 0.5 seconds
 
     def write_to_fd(self, data):
         self.master.zigbeeTx(self.address16, self.address64, data)
@@ -70,6 +70,9 @@ class RemoteZigbee(ArduinoController):
 
         return True
 
+    def get_next_update_time(self, cur_time_s):
+        return earliest_time(self.get_sync_times()) # writes go through the master
+
     def initialize_board(self):
         ArduinoProtocol.set_pin_ranges(
             -self.definition.digital_port_start_range, self.definition.num_digital_ports,
@@ -245,6 +248,9 @@ class ZigbeeController(HardwareController):
 
         return True
 
+    def get_next_update_time(self, cur_time_s):
+        return earliest_time([super(ZigbeeController, self).get_next_update_time(cur_time_s)] + list(map(lambda z: z.get_next_update_time(cur_time_s), self.m_remoteZigbees.values())))
+
     def onZigbeeFrame(self, frame, checksum, cur_time_s):
         if self.zigbeeCheckChecksum(frame, checksum):
             cmdID = frame[0]
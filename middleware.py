@@ -2,15 +2,23 @@
 
 import config.cmd_args
 
+from config.general_config import GENERAL_CONFIG
 from logs import Log
 from core.core import Core
 
+import asyncio
+
 if __name__ == '__main__':
     # Initialize and run the core
     Log.initialize()
     core = Core()
     try:
-        core.run()
+        if GENERAL_CONFIG.USE_ASYNCIO:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(core.run_async())
+        else:
+            core.run()
     except:
         Log.fatal("Fatal error in program: ", exception=True)
     core.cleanup()
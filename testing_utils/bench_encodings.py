@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+#
+# Compares the controller encodings (encode/decode time and bytes on the wire)
+# on typical big_update payloads
+# Usage: python testing_utils/bench_encodings.py [number of rooms]
+#
+import os, sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import core # the controllers package can only be imported after the core
+from controllers.encodings import JSONEncoding, BinaryEncoding
+
+# returns  A list of (name, big_update) of typical payloads for a building with num_rooms rooms
+def make_payloads(num_rooms):
+    room_things = lambda r: {
+        "lightswitch-{}-1".format(r): {"intensity": 1, "token": "system"},
+        "dimmer-{}-1".format(r): {"intensity": 65, "token": "a3f9c2e1"},
+        "curtain-{}-1".format(r): {"curtain": 0, "token": "system"},
+        "central-ac-{}".format(r): {"set_pt": 22.5, "temp": 24.1, "fan": 1, "token": "system"},
+        "hotel-controls-{}".format(r): {"card": 1, "do_not_disturb": 0, "room_service": 0, "power": 1, "token": "system"},
+    }
+    full = {}
+    for r in range(num_rooms):
+        full.update(room_things(r))
+    single = dict([list(full.items())[1]])
+    room = room_things(0)
+    return [("single change", single), ("room", room), ("full view", full)]
+
+# returns  The symbol table the middleware would build for these payloads
+def make_symbols(payload):
+    keys = set(["token", "thing", "code"])
+    for state in payload.values():
+        keys.update(state.keys())
+    return sorted(payload.keys()) + sorted(keys)
+
+def run(num_rooms):
+    payloads = make_payloads(num_rooms)
+    encodings = [JSONEncoding(), BinaryEncoding(make_symbols(payloads[-1][1]))]
+    print("{:<14} {:<7} {:>10} {:>12} {:>12}".format("payload", "codec", "bytes", "encode (us)", "decode (us)"))
+    for (name, payload) in payloads:
+        number = max(1, 2000 // len(payload))
+        for encoding in encodings:
+            data = encoding.encode(payload)
+            assert encoding.decode(data) == payload
+            encode_us = timeit.timeit(lambda: encoding.encode(payload), number=number) / number * 1e6
+            decode_us = timeit.timeit(lambda: encoding.decode(data), number=number) / number * 1e6
+            print("{:<14} {:<7} {:>10} {:>12.1f} {:>12.1f}".format(name, encoding.name, len(data), encode_us, decode_us))
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -14,6 +14,8 @@ class SplitAC(Thing):
         return "split_acs"
 
 class CentralAC(Thing):
+    MERGEABLE_STATE_KEYS = frozenset(["set_pt", "fan"])
+
     def __init__(self, blueprint, J):
         super(CentralAC, self).__init__(blueprint, J)
         self.params = ThingParams(J, [
@@ -145,6 +147,9 @@ class CentralAC(Thing):
                         self.digital_valve_output = 1
         return False
 
+    def get_next_update_time(self, cur_time_s):
+        return self.next_valve_update
+
     def get_state(self):
         return {
             "temp": self.current_temperature,
@@ -43,12 +43,17 @@ class Bell(Thing):
         if ring_timer:
             if cur_time_s - self.bell_ring_start < ring_timer:
                 self.is_bell_ringing = 1
-                return True # need update again to make accurate timer
             else:
                 self.is_bell_ringing = 0
 
         return False
 
+    def get_next_update_time(self, cur_time_s):
+        ring_timer = self.params.get("ring_timer")
+        if ring_timer and self.is_bell_ringing:
+            return self.bell_ring_start + ring_timer # update again to make accurate timer
+        return None
+
     def get_state(self):
         return {}
 
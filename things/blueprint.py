@@ -13,6 +13,7 @@ from logs import Log
 from config.general_config import GENERAL_CONFIG
 
 import json
+import hashlib
 from functools import reduce
 
 class RemoteBoard(object):
@@ -109,8 +110,11 @@ class Blueprint(object):
             return
 
         self.id = str(J["id"])
+        self.version = 0 # incremented whenever the config changes
+        self.controller_config = None # (version, config part of the controller view) built by get_controller_config
         self.display = J.get("display", {})
         self.translations = J.get("translations", {})
+        self.hotel_controls = [] # HotelControls Things (they keep the other Things asleep while the power is off)
         self.rooms = [Room(self, R) for R in J["rooms"]]
         found_room_ids = {}
         for R in self.rooms:
@@ -122,6 +126,7 @@ class Blueprint(object):
         self.remote_boards = {}
         for key in remote_boards_data.keys():
             self.remote_boards[key] = RemoteBoard(key, remote_boards_data[key])
+        self.hotel_controls = list(filter(lambda t: isinstance(t, HotelControls), self.get_things()))
 
     # Load a thing from a JSON config and append to to the given room
     # thing_json  JSON of the Thing config
@@ -144,20 +149,49 @@ class Blueprint(object):
     def cleanup(self):
         pass
 
+    # Changes a display setting of the blueprint
+    # key    Display setting to change
+    # value  New value
+    def set_display(self, key, value):
+        self.display[key] = value
+        self.version += 1
+
     # returns  The config view of the blueprint for the controller
     def get_controller_view(self):
-        view = {
-            "config": {
+        view = {"config": self.get_controller_config()}
+        for thing in self.get_things():
+            view[thing.id] = self.get_thing_view(thing)
+        return view
+
+    # returns  The static part of the controller view (display, translations and rooms), built once
+    #          per version of the blueprint (must not be modified). It includes an "etag" which is
+    #          a hash of the rest of the config
+    def get_controller_config(self):
+        if self.controller_config == None or self.controller_config[0] != self.version:
+            config = {
                 "display": self.display,
                 "translations": self.translations,
                 "rooms": list(map(lambda r: r.config, self.rooms)),
                 "id": str(self.id)
             }
-        }
-        for room in self.rooms:
-            for thing in room.things.keys():
-                view[thing] = room.things[thing].get_state()
-                view[thing]["category"] = room.things[thing].__class__.get_blueprint_tag()
+            config["etag"] = hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+            self.controller_config = (self.version, config)
+        return self.controller_config[1]
+
+    # returns  Hash of the config part of the controller view
+    def get_config_etag(self):
+        return self.get_controller_config()["etag"]
+
+    # thing    A Thing
+    # state    State of the Thing published on the state bus (None to get the state from the Thing)
+    # returns  The state of the Thing as it appears in the controller view
+    def get_thing_view(self, thing, state=None):
+        if state != None:
+            view = dict(state)
+            del view["token"]
+        else:
+            view = thing.get_state()
+        view["category"] = thing.__class__.get_blueprint_tag()
         return view
 
     # returns  All things
@@ -196,6 +230,19 @@ class Blueprint(object):
                     listeners.append(thing)
         return listeners
 
+    # Called when something happens to a Thing that might change its state. While the power
+    # is off, HotelControls are updated too so they put the changed Thing back to sleep
+    # (unless they are the ones putting the Things to sleep)
+    # thing  The Thing that was marked dirty
+    def on_thing_dirty(self, thing):
+        scheduler = self.core.thing_scheduler
+        scheduler.schedule_now(thing)
+        self.core.state_bus.mark_dirty(thing)
+        if not isinstance(scheduler.updating_thing, HotelControls):
+            for hotel_controls in self.hotel_controls:
+                if hotel_controls.power == 0:
+                    scheduler.schedule_now(hotel_controls)
+
     # Retrieves a RemoteBoard object for a given board address
     # address  64 bit address of a Zigbee (number)
     # returns  A RemoteBoard object corresponding to that address, or None if not defined
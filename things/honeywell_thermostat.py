@@ -3,6 +3,8 @@ from logs import Log
 import json
 
 class HoneywellThermostatT7560(Thing):
+    MERGEABLE_STATE_KEYS = frozenset(["set_pt", "fan"])
+
     def __init__(self, blueprint, J):
         super(HoneywellThermostatT7560, self).__init__(blueprint, J)
         self.params = ThingParams(J, [
@@ -96,12 +96,20 @@ class HotelControls(Thing):
             self.card_out_start = -1
             self.power = 1 # turn on power
 
-        if self.power == 0: # force sleep everything, every update...
+        if self.power == 0: # force sleep everything (while the power is off, the blueprint updates HotelControls whenever another Thing changes)
             things = self.blueprint.get_things()
             for thing in things:
                 thing.sleep(self)
         return False
 
+    def get_next_update_time(self, cur_time_s):
+        deadlines = []
+        if self.door_open == 0 and self.welcome_light == 1:
+            deadlines.append(self.welcome_light_start_time + self.params.get("welcome_light_duration"))
+        if self.card_in == 0 and self.card_out_start != -1:
+            deadlines.append(self.card_out_start + self.params.get("nocard_power_timeout"))
+        return min(deadlines) if len(deadlines) > 0 else None
+
     def get_state(self):
         return {
             "card": self.card_in if self.params.get("display_nocard_warning") else True,
@@ -83,6 +83,10 @@ class KitchenControls(Thing):
         self.orders = list(filter(lambda o: o["timeout"] < 0 or o["timeout"] > cur_time_s, self.orders))
         return False
 
+    def get_next_update_time(self, cur_time_s):
+        timeouts = list(filter(lambda t: t >= 0, map(lambda o: o["timeout"], self.orders)))
+        return min(timeouts) if len(timeouts) > 0 else None
+
     def get_state(self):
         return {
             "orders": json.loads(json.dumps(self.orders)),
@@ -3,6 +3,8 @@ from logs import Log
 import json
 
 class LightSwitch(Thing):
+    MERGEABLE_STATE_KEYS = frozenset(["intensity"])
+
     def __init__(self, blueprint, J):
         super(LightSwitch, self).__init__(blueprint, J)
         self.params = ThingParams(J, [
@@ -74,6 +76,8 @@ class LightSwitch(Thing):
         return state
 
 class Dimmer(Thing):
+    MERGEABLE_STATE_KEYS = frozenset(["intensity"])
+
     def __init__(self, blueprint, J):
         super(Dimmer, self).__init__(blueprint, J)
         self.params = ThingParams(J, [
@@ -50,11 +50,14 @@ class SoftSwitch(Thing):
                 prev_state = self.button_state
                 self.button_state = self.last_read_value
                 self.on_state_changed(prev_state, self.button_state)
-        elif self.debounce_timeout > 0:
-            return True
 
         return False
 
+    def get_next_update_time(self, cur_time_s):
+        if self.debounce_timeout > 0:
+            return self.debounce_timeout
+        return None
+
 class TwoWaySwitch(SoftSwitch):
     def __init__(self, blueprint, switch_json):
         self.id = switch_json.get("id", "twowayswitch-" + switch_json["switch_port"])
@@ -3,12 +3,17 @@ from functools import reduce
 import itertools
 
 class Thing(object):
+    # Keys of state commands for which only the latest value matters: consecutive commands from
+    # a controller that only change these keys are merged (see ControllersManager.queue_thing_command)
+    MERGEABLE_STATE_KEYS = frozenset()
+
     def __init__(self, blueprint, thing_json):
         # auto-generated attributes
         self.blueprint = blueprint
         self.id = ""                            # id of this Thing
         self.name = thing_json["name"]          # name of this Thing
         self.last_change_token = ""             # token from the controller who last changed the state
+        self.state_version = 0                  # incremented by the state bus whenever the state changes
 
         self.input_ports = {}                   # Dictionary of pin -> {"read_interval": (int), "is_pullup": (bool)}
                                                 # OR            pin -> read_interval (int)
@@ -36,27 +41,40 @@ class Thing(object):
     # source  The Thing that caused the sleep to happen. Could be None to indicate "system"
     def sleep(self, source=None):
         self.last_change_token = "system"
-        pass
+        self.mark_dirty()
 
     # Should be implemented to order this Thing wake up (usually turn on)
     # source  The Thing that caused the wake-up to happen. Could be None to indicate "system"
     def wake_up(self, source=None):
         self.last_change_token = "system"
-        pass
+        self.mark_dirty()
 
-    # perform any Thing-specific logic
+    # perform any Thing-specific logic. Called when the Thing is marked dirty or
+    # when the time returned by get_next_update_time() is reached
     # cur_time_s  Current time in seconds
     # returns     returns whether or not another updated is required ASAP after a
-    #             select cycle
+    #             select cycle (prefer implementing get_next_update_time())
     def update(self, cur_time_s):
         return False
 
+    # Should be implemented by Things that need to be updated at a certain time (e.g. timers)
+    # cur_time_s  Current time in seconds
+    # returns     Time (in seconds) at which update() needs to be called again, None if
+    #             the Thing only needs to be updated when it is marked dirty
+    def get_next_update_time(self, cur_time_s):
+        return None
+
+    # Called whenever something happens to this Thing that might change its state
+    def mark_dirty(self):
+        self.blueprint.on_thing_dirty(self)
+
     # Called by the blueprint when hardware has an updated value on a port
     # port     Port that has updated its value
     # value    New value on that port
     # returns  True iff the changes made to the state are more than just the input
     def set_hardware_state(self, port, value):
         self.last_change_token = "system"
+        self.mark_dirty()
         return True
 
     # Called by the blueprint when a controller sends a message
@@ -65,6 +83,7 @@ class Thing(object):
     # returns    True iff the changes made to the state are more than just the input
     def set_state(self, data, token_from="system"):
         self.last_change_token = token_from
+        self.mark_dirty()
         return True
 
     # Called by the blueprint ONCE (at the beginning) to know if there is any metadata for this Thing
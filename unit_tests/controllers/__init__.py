@@ -0,0 +1 @@
+import core # the controllers package can only be imported after the core
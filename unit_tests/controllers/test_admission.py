@@ -0,0 +1,64 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from config.controllers_config import CONTROLLERS_CONFIG
+from controllers.authentication import USER, TOKEN_TYPE
+from controllers.tcp_socket_controllers.tcp_socket_controller import TCPSocketController
+
+import socket
+
+class RegisteredController(object):
+    def __init__(self, manager, origin_name):
+        self.manager = manager
+        self.origin_name = origin_name
+        self.authenticated_user = None
+        self.destroyed = False
+        manager.register_controller(self)
+
+    def destroy_selectible(self):
+        self.destroyed = True
+        self.manager.deregister_controller(self)
+
+    def authenticate(self, token_type):
+        self.authenticated_user = USER(token=str(id(self)), token_type=token_type)
+        self.manager.on_controller_authenticated(self)
+
+class TestAdmission(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def test_connection_limits(self):
+        per_origin = CONTROLLERS_CONFIG.MAX_CONNECTIONS_PER_ORIGIN
+        controllers = list(map(lambda i: RegisteredController(self.manager, "10.0.0.1"), range(per_origin)))
+        assert not self.manager.can_connect_from_origin("10.0.0.1")
+        assert self.manager.can_connect_from_origin("10.0.0.2")
+        rejected = RegisteredController(self.manager, "10.0.0.1")
+        assert rejected.destroyed and self.manager.num_connected_controllers == per_origin
+
+        for controller in controllers:
+            controller.destroy_selectible()
+        assert self.manager.num_connected_controllers == 0
+        assert self.manager.connected_controllers == {}
+        assert self.manager.can_connect_from_origin("10.0.0.1")
+
+    def test_rejected_controller(self):
+        per_origin = CONTROLLERS_CONFIG.MAX_CONNECTIONS_PER_ORIGIN
+        controllers = list(map(lambda i: RegisteredController(self.manager, "127.0.0.1"), range(per_origin)))
+        (a, b) = socket.socketpair()
+        rejected = TCPSocketController(self.manager, a, ("127.0.0.1", 0)) # destroyed by the manager while registering
+        assert rejected not in self.manager.connected_controllers["127.0.0.1"]
+        assert self.manager.num_connected_controllers == per_origin
+        b.close()
+
+    def test_controllers_by_type(self):
+        hub = RegisteredController(self.manager, "10.0.0.1")
+        tablet = RegisteredController(self.manager, "10.0.0.2")
+        hub.authenticate(TOKEN_TYPE.HUB)
+        tablet.authenticate(TOKEN_TYPE.CONTROLLER)
+        assert self.manager.get_controllers_by_type(TOKEN_TYPE.HUB) == [hub]
+        assert self.manager.get_controllers_by_type(TOKEN_TYPE.CONTROLLER) == [tablet]
+
+        tablet.authenticate(TOKEN_TYPE.HUB) # authenticated again with another token
+        assert self.manager.get_controllers_by_type(TOKEN_TYPE.HUB) == [hub, tablet]
+        assert self.manager.get_controllers_by_type(TOKEN_TYPE.CONTROLLER) == []
+
+        hub.destroy_selectible()
+        assert self.manager.get_controllers_by_type(TOKEN_TYPE.HUB) == [tablet]
@@ -0,0 +1,94 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from unit_tests.utilities.fake_objects import FakeSender
+from things.kitchen_controls import KitchenControls
+
+import json
+
+class TestBatchCommands(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestBatchCommands, self).setup()
+        self.controller = FakeSender()
+
+    def test_batch(self):
+        self.manager.on_command(self.controller, {"batch": [
+            {"thing": "lightswitch-d37", "intensity": 1, "token": "a"},
+            {"thing": "lightswitch-d36", "intensity": 1},
+            {"thing": "lightswitch-d37", "intensity": 0, "token": "b"},
+        ]})
+        self.manager.apply_thing_commands()
+        assert self.controller.sent == [{"batch": 3}]
+        d37 = self.core.blueprint.get_thing("lightswitch-d37")
+        assert d37.get_state()["intensity"] == 0 and d37.last_change_token == "b"
+        assert self.core.blueprint.get_thing("lightswitch-d36").get_state()["intensity"] == 1
+
+    def test_batch_access(self):
+        self.controller.things_listening = set(["lightswitch-d36"])
+        self.manager.on_command(self.controller, {"batch": [
+            {"thing": "lightswitch-d37", "intensity": 1},
+            {"thing": "lightswitch-d36", "intensity": 1},
+            {"thing": "unknown", "intensity": 1},
+            {"code": 0},
+        ]})
+        self.manager.apply_thing_commands()
+        assert self.controller.sent == [{"batch": 1}]
+        assert self.core.blueprint.get_thing("lightswitch-d37").get_state()["intensity"] == 0
+
+    def test_batch_failed_command(self):
+        self.manager.on_command(self.controller, {"batch": [
+            {"thing": "lightswitch-d37", "intensity": 1},
+            {"thing": "dimmer-d4", "intensity": "invalid"}, # fails in set_state
+        ]})
+        assert self.controller.sent == [] # acknowledged once applied
+        self.manager.apply_thing_commands()
+        assert self.controller.sent == [{"batch": 1}]
+        assert self.core.blueprint.get_thing("lightswitch-d37").get_state()["intensity"] == 1
+
+    def test_coalescing(self):
+        for i in range(10): # slider drag
+            self.manager.on_command(self.controller, {"thing": "dimmer-d4", "intensity": i * 10, "token": str(i)})
+        self.manager.on_command(self.controller, {"thing": "lightswitch-d37", "intensity": 1})
+        self.manager.on_command(self.controller, {"thing": "dimmer-d4", "intensity": 5, "token": "x"})
+        assert list(map(lambda tc: (tc[1].id, tc[2]["intensity"]), self.manager.thing_commands)) == \
+            [("dimmer-d4", 90), ("lightswitch-d37", 1), ("dimmer-d4", 5)]
+
+        self.manager.apply_thing_commands()
+        dimmer = self.core.blueprint.get_thing("dimmer-d4")
+        assert dimmer.get_state()["intensity"] == 5 and dimmer.last_change_token == "x"
+        assert self.manager.thing_commands == []
+
+    def test_coalescing_other_controller(self):
+        other = FakeSender()
+        self.manager.on_command(self.controller, {"thing": "dimmer-d4", "intensity": 10})
+        self.manager.on_command(other, {"thing": "dimmer-d4", "intensity": 20})
+        assert len(self.manager.thing_commands) == 2
+
+    def test_no_coalescing_orders(self):
+        kitchen = KitchenControls(self.core.blueprint, {"name": "Kitchen", "menu": ["Tea", "Coffee"]})
+        self.core.blueprint.rooms[0].things[kitchen.id] = kitchen
+        self.manager.on_command(self.controller, {"thing": "kitchen", "order": [{"name": "Tea", "quantity": 1}], "placed_by_name": "a"})
+        self.manager.on_command(self.controller, {"thing": "kitchen", "order": [{"name": "Coffee", "quantity": 1}], "placed_by_name": "b"})
+        self.manager.apply_thing_commands()
+        orders = kitchen.get_state()["orders"]
+        assert list(map(lambda o: o["placed_by_name"], orders)) == ["a", "b"]
+
+    def test_applied_before_control_command(self):
+        views = []
+        self.controller.send_controller_view = lambda with_config=True: \
+            views.append(json.loads(self.manager.get_encoded_view(self.manager.encodings["json"]).decode("utf-8")))
+        other = FakeSender()
+        self.manager.on_command(other, {"thing": "dimmer-d4", "intensity": 20})
+        self.manager.on_command(self.controller, {"thing": "lightswitch-d37", "intensity": 1})
+        self.manager.on_command(self.controller, {"code": 0})
+        assert self.manager.thing_commands == []
+        assert views[0]["lightswitch-d37"]["intensity"] == 1
+        assert views[0]["dimmer-d4"]["intensity"] == 20 # applied in order with the other controllers' commands
+
+    def test_deferred_without_control_command(self):
+        other = FakeSender()
+        other.send_controller_view = lambda with_config=True: None
+        self.manager.on_command(self.controller, {"thing": "lightswitch-d37", "intensity": 1})
+        self.manager.on_command(other, {"code": 0}) # another controller's control command does not apply it
+        assert len(self.manager.thing_commands) == 1
@@ -0,0 +1,67 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from config.controllers_config import CONTROLLERS_CONFIG
+
+from collections import deque
+
+class QueueController(object):
+    def __init__(self, name, handled):
+        self.name = name
+        self.handled = handled
+        self.queued_commands = deque()
+        self.num_deferrals = 0
+
+    def handle_queued_command(self):
+        self.handled.append((self.name, self.queued_commands.popleft()))
+
+    def update(self, cur_time_s):
+        return True
+
+    def get_next_write_time(self, cur_time_s):
+        return None
+
+    def get_next_flush_time(self):
+        return None
+
+class TestCommandScheduling(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestCommandScheduling, self).setup()
+        self.handled = []
+        self.commands_per_tick = CONTROLLERS_CONFIG.COMMANDS_PER_TICK
+        CONTROLLERS_CONFIG.COMMANDS_PER_TICK = 3
+
+    def teardown(self):
+        CONTROLLERS_CONFIG.COMMANDS_PER_TICK = self.commands_per_tick
+        self.manager.connected_controllers = {}
+        super(TestCommandScheduling, self).teardown()
+
+    def add_controller(self, origin, name, num_commands):
+        controller = QueueController(name, self.handled)
+        controller.queued_commands.extend(range(num_commands))
+        self.manager.connected_controllers.setdefault(origin, []).append(controller)
+        return controller
+
+    def test_round_robin_with_budget(self):
+        flood = self.add_controller("10.0.0.1", "flood", 10)
+        tablet = self.add_controller("10.0.0.2", "tablet", 2)
+        self.manager.handle_commands()
+        assert sorted(self.handled) == sorted([("flood", 0), ("flood", 1), ("flood", 2), ("tablet", 0), ("tablet", 1)])
+        assert self.handled.index(("tablet", 0)) < self.handled.index(("flood", 1)) # interleaved
+        assert len(flood.queued_commands) == 7 and flood.num_deferrals == 1
+        assert tablet.num_deferrals == 0
+        for C in self.manager.connection_managers:
+            C.reconnect_timer = 100
+        assert self.manager.get_next_update_time(5) == 5 # leftovers are handled on the next tick
+        assert self.manager.get_origin_stats()["10.0.0.1"] == {"queued_commands": 7, "deferrals": 1}
+
+        self.manager.handle_commands()
+        assert len(flood.queued_commands) == 4 and flood.num_deferrals == 2
+
+    def test_once_per_tick(self):
+        flood = self.add_controller("10.0.0.1", "flood", 10)
+        for C in self.manager.connection_managers:
+            C.reconnect_timer = 100
+        self.core.update(1)
+        assert len(self.handled) == 3 and flood.num_deferrals == 1
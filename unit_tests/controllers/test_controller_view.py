@@ -0,0 +1,83 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from controllers.tcp_socket_controllers.tcp_socket_controller import TCPSocketController
+
+import socket
+import struct
+import json
+import zlib
+
+class TestControllerView(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestControllerView, self).setup()
+        self.core.state_bus.flush()
+        self.encoding = self.manager.encodings["json"]
+
+    def encoded_view(self):
+        return json.loads(self.manager.get_encoded_view(self.encoding).decode("utf-8"))
+
+    def test_view_matches_blueprint(self):
+        assert self.encoded_view() == self.core.blueprint.get_controller_view()
+
+    def test_invalidation(self):
+        thing = self.core.blueprint.get_things()[0]
+        thing.set_state({"intensity": 1})
+        self.core.state_bus.flush()
+        assert self.encoded_view()[thing.id] == self.core.blueprint.get_thing_view(thing)
+
+        self.core.blueprint.set_display("QRCodeAddress", "qr")
+        assert self.encoded_view()["config"]["display"]["QRCodeAddress"] == "qr"
+
+    def test_etag(self):
+        etag = self.encoded_view()["config"]["etag"]
+        view = json.loads(self.manager.get_encoded_view(self.encoding, with_config=False).decode("utf-8"))
+        assert "config" not in view and view["etag"] == etag
+        assert len(view) == len(self.core.blueprint.get_things()) + 1
+
+        self.core.blueprint.set_display("QRCodeAddress", "qr")
+        assert self.core.blueprint.get_config_etag() != etag
+
+    def test_config_compressed_once(self):
+        config_chunk = self.manager.get_view_config_chunk(self.encoding, True, True)
+        thing = self.core.blueprint.get_things()[0]
+        thing.set_state({"intensity": 1})
+        self.core.state_bus.flush()
+        view = self.manager.get_encoded_view(self.encoding, compressed=True)
+        assert self.manager.get_view_config_chunk(self.encoding, True, True) is config_chunk # not compressed again
+        assert json.loads(zlib.decompressobj(-15).decompress(view).decode("utf-8")) == self.core.blueprint.get_controller_view()
+
+        binary = self.manager.encodings["binary"]
+        assert binary.decode(self.manager.get_encoded_view(binary)) == self.core.blueprint.get_controller_view()
+
+    def test_compressed_stream(self):
+        (a, b) = socket.socketpair()
+        controller = TCPSocketController(self.manager, a, ("127.0.0.1", 0))
+        controller.set_compression("deflate")
+        controller.send_data({"message": 1})
+        controller.send_controller_view()
+        controller.send_data({"message": 2})
+        controller.send_controller_view(with_config=False)
+        controller.send_data({"message": 3})
+        controller.destroy_selectible() # writes everything
+        data = b""
+        while True:
+            received = b.recv(65536)
+            if len(received) == 0:
+                break
+            data += received
+        b.close()
+
+        frames = []
+        while len(data) > 0:
+            length = struct.unpack_from('<I', data)[0]
+            frames.append(data[4:4+length])
+            data = data[4+length:]
+        assert json.loads(frames[0].decode("utf-8")) == {"compression": "deflate"}
+        decompressor = zlib.decompressobj(-15) # one stream for all the compressed messages
+        messages = list(map(lambda frame: json.loads(decompressor.decompress(frame).decode("utf-8")), frames[1:]))
+        assert len(messages) == 5
+        assert messages[0] == {"message": 1} and messages[2] == {"message": 2} and messages[4] == {"message": 3}
+        assert messages[1] == self.encoded_view()
+        assert messages[3] == json.loads(self.manager.get_encoded_view(self.encoding, with_config=False).decode("utf-8"))
@@ -0,0 +1,29 @@
+from controllers.encodings import JSONEncoding, BinaryEncoding
+
+SAMPLE = {
+    "lightswitch-1": {"intensity": 1, "token": "abc"},
+    "dimmer-2": {"intensity": 75, "token": ""},
+    "central-ac-3": {"set_pt": 22.5, "temp": -3, "fan": 2, "token": "system", "zones": [1, 70000, None, True, False]},
+    "long": {"token": "x" * 300, "big": 2 ** 40, "neg": -2 ** 20},
+}
+
+class TestEncodings(object):
+    def setup_method(self, method):
+        self.encodings = [
+            JSONEncoding(),
+            BinaryEncoding(["lightswitch-1", "dimmer-2", "intensity", "token"]),
+        ]
+
+    def test_round_trip(self):
+        for encoding in self.encodings:
+            assert encoding.decode(encoding.encode(SAMPLE)) == SAMPLE
+
+    def test_spliced_map(self):
+        for encoding in self.encodings:
+            members = list(map(lambda key: encoding.encode_member(key, SAMPLE[key]), SAMPLE))
+            assert encoding.encode_map(members) == encoding.encode(SAMPLE)
+
+    def test_symbols_are_interned(self):
+        binary = self.encodings[1]
+        assert binary.encode({"intensity": 1}) == bytes([0x81, 0xd4, BinaryEncoding.SYMBOL_TYPE, 2, 0x01])
+        assert len(binary.encode(SAMPLE)) < len(self.encodings[0].encode(SAMPLE))
@@ -0,0 +1,96 @@
+from controllers.controller_base import Controller
+from unit_tests.utilities.fake_objects import FakeThing, FakeManager
+from config.controllers_config import CONTROLLERS_CONFIG
+
+class RecordingController(Controller):
+    def __init__(self, manager):
+        super(RecordingController, self).__init__(manager, "origin")
+        self.authenticated_user = "user"
+        self.pending_write_size = 0
+        self.sent = []
+
+    def send_data(self, json_data):
+        self.sent.append(json_data)
+        return True
+
+class TestSentVersions(object):
+    def setup_method(self, method):
+        self.manager = FakeManager()
+        self.bus = self.manager.core.state_bus
+        self.thing = FakeThing("light")
+        self.bus.mark_dirty(self.thing)
+        self.bus.flush()
+        self.controller = RecordingController(self.manager)
+        self.batch_interval = CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL
+        CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL = 0
+
+    def teardown_method(self, method):
+        CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL = self.batch_interval
+
+    def publish(self, intensity):
+        self.thing.intensity = intensity
+        self.bus.mark_dirty(self.thing)
+        self.bus.flush()
+
+    def test_sends_only_new_versions(self):
+        self.controller.update(0)
+        assert self.controller.sent == [{"light": {"intensity": 0, "token": ""}}]
+        assert self.controller.sent_versions == {"light": 1}
+
+        self.publish(0) # unchanged
+        self.controller.update(0)
+        assert len(self.controller.sent) == 1
+
+        self.publish(1)
+        self.controller.update(0)
+        assert self.controller.sent[-1] == {"light": {"intensity": 1, "token": ""}}
+        assert self.controller.sent_versions == {"light": 2}
+
+    def test_invalidate_cache_resends(self):
+        self.controller.update(0)
+        self.controller.invalidate_cache(thing_id="light")
+        self.controller.update(0)
+        assert len(self.controller.sent) == 2
+
+    def test_resume_session(self):
+        token = self.bus.get_resume_token()
+        other = FakeThing("other")
+        self.bus.mark_dirty(other)
+        self.bus.flush()
+
+        controller = RecordingController(self.manager)
+        controller.resume_session(token)
+        controller.update(0)
+        assert controller.sent == [{"other": {"intensity": 0, "token": ""}, "resume-token": self.bus.get_resume_token()}]
+
+        controller = RecordingController(self.manager)
+        controller.resume_session("expired")
+        controller.update(0)
+        assert sorted(controller.sent[0].keys()) == ["light", "other", "resume-token"]
+
+    def test_batching(self):
+        CONTROLLERS_CONFIG.UPDATE_BATCH_INTERVAL = 0.02
+        self.controller.update(1)
+        assert self.controller.sent == [] and self.controller.get_next_flush_time() == 1.02
+        self.publish(1)
+        self.controller.update(1.01)
+        assert self.controller.sent == []
+        self.controller.update(1.02)
+        assert self.controller.sent == [{"light": {"intensity": 1, "token": ""}}]
+        assert self.controller.get_next_flush_time() == None
+
+    def test_backpressure(self):
+        self.controller.pending_write_size = CONTROLLERS_CONFIG.SEND_BUFFER_HIGH_WATERMARK
+        assert self.controller.update(1)
+        self.publish(1)
+        self.publish(2)
+        assert self.controller.update(2)
+        assert self.controller.sent == [] and self.controller.get_stats()["backpressure"]
+
+        self.controller.pending_write_size = 0
+        assert self.controller.update(3)
+        assert self.controller.sent == [{"light": {"intensity": 2, "token": ""}}] # only the latest state
+
+        self.controller.pending_write_size = CONTROLLERS_CONFIG.SEND_BUFFER_HIGH_WATERMARK
+        assert self.controller.update(4)
+        assert not self.controller.update(4 + CONTROLLERS_CONFIG.SLOW_CONSUMER_TIMEOUT)
@@ -0,0 +1,16 @@
+from controllers.controller_base import StateFragmentCache
+
+class TestStateFragmentCache(object):
+    def test_encodes_once_per_version(self):
+        cache = StateFragmentCache()
+        encoded = []
+        def encode(value):
+            encoded.append(value)
+            return value
+        assert cache.get("json", "light", 1, lambda: encode(b"1")) == b"1"
+        assert cache.get("json", "light", 1, lambda: encode(b"x")) == b"1"
+        assert cache.get("json", "light", 2, lambda: encode(b"2")) == b"2"
+        assert encoded == [b"1", b"2"]
+
+        cache.clear()
+        assert cache.get("json", "light", 2, lambda: encode(b"3")) == b"3"
@@ -0,0 +1,92 @@
+from controllers.tcp_socket_controllers.tcp_socket_controller import TCPSocketController
+from unit_tests.utilities.fake_objects import FakeManager
+from config.controllers_config import CONTROLLERS_CONFIG
+
+import socket
+import struct
+import json
+
+class RecordingController(TCPSocketController):
+    def __init__(self, manager, conn):
+        self.commands = []
+        super(RecordingController, self).__init__(manager, conn, ("127.0.0.1", 0))
+
+    def on_command(self, command):
+        self.commands.append(command)
+
+def frame(command):
+    data = json.dumps(command).encode("utf-8")
+    return struct.pack('<I', len(data)) + data
+
+class TestTCPFraming(object):
+    def setup_method(self, method):
+        (self.a, self.b) = socket.socketpair()
+        self.controller = RecordingController(FakeManager(), self.a)
+
+    def teardown_method(self, method):
+        self.controller.destroy_selectible()
+        self.b.close()
+
+    # returns  The commands received so far (handles the queued commands)
+    def received(self):
+        while len(self.controller.queued_commands) > 0:
+            self.controller.handle_queued_command()
+        return self.controller.commands
+
+    def test_pipelined_commands(self):
+        commands = list(map(lambda i: {"thing": "light", "intensity": i}, range(500)))
+        self.b.sendall(b"".join(map(frame, commands)))
+        assert self.controller.on_read_ready(0)
+        assert self.received() == commands
+        assert self.controller.read_start == self.controller.read_end == 0
+
+    def test_split_command(self):
+        data = frame({"thing": "light", "intensity": 1})
+        self.b.sendall(data[:3])
+        assert self.controller.on_read_ready(0)
+        self.b.sendall(data[3:8])
+        assert self.controller.on_read_ready(0)
+        assert self.received() == []
+        self.b.sendall(data[8:])
+        assert self.controller.on_read_ready(0)
+        assert self.received() == [{"thing": "light", "intensity": 1}]
+
+    def test_buffer_compaction(self):
+        big = {"thing": "light", "data": "x" * (TCPSocketController.MAXIMUM_COMMAND_LENGTH - 100)}
+        data = frame(big) * 4 # more than the receive buffer, received in pieces across commands
+        for i in range(0, len(data), 7000):
+            self.b.sendall(data[i:i+7000])
+            assert self.controller.on_read_ready(0)
+        assert self.received() == [big] * 4
+
+    def test_too_long(self):
+        self.b.sendall(struct.pack('<I', TCPSocketController.MAXIMUM_COMMAND_LENGTH + 1))
+        assert not self.controller.on_read_ready(0)
+
+    def test_hang_up(self):
+        self.b.close()
+        assert not self.controller.on_read_ready(0)
+
+    def test_queue_limit(self):
+        max_queued = CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS
+        CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS = 4
+        try:
+            commands = list(map(lambda i: {"thing": "light", "intensity": i}, range(10)))
+            self.b.sendall(b"".join(map(frame, commands)))
+            assert self.controller.on_read_ready(0)
+            assert len(self.controller.queued_commands) == 4 # the rest stays in the receive buffer
+            assert self.received() == commands
+        finally:
+            CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS = max_queued
+
+    def test_resumes_reading(self):
+        max_queued = CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS
+        CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS = 2
+        try:
+            commands = list(map(lambda i: {"thing": "light", "name": str(i) * 10000}, range(10)))
+            self.b.sendall(b"".join(map(frame, commands))) # more than the receive buffer
+            assert self.controller.on_read_ready(0)
+            assert len(self.controller.queued_commands) == 2
+            assert self.received() == commands # read without the socket being reported readable again
+        finally:
+            CONTROLLERS_CONFIG.MAX_QUEUED_COMMANDS = max_queued
@@ -0,0 +1,53 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from config.controllers_config import CONTROLLERS_CONFIG
+from controllers.tcp_socket_controllers.tcp_socket_manager import TLSHandshake
+from core.select_service import SelectService
+
+import socket
+import ssl
+
+class FakeHostedSocket(object):
+    def __init__(self, connection_manager):
+        self.connection_manager = connection_manager
+
+class TestTLSHandshake(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestTLSHandshake, self).setup()
+        self.connection_manager = self.manager.connection_managers[1]
+        self.connection_manager.reconnect_timer = 100
+        (self.a, self.b) = socket.socketpair()
+        self.a.setblocking(False)
+        conn = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).wrap_socket(self.a, server_side=True, do_handshake_on_connect=False)
+        self.handshake = TLSHandshake(FakeHostedSocket(self.connection_manager), conn, ("127.0.0.1", 0), 1)
+
+    def teardown(self):
+        self.handshake.destroy_selectible()
+        self.b.close()
+        super(TestTLSHandshake, self).teardown()
+
+    def test_waits_without_blocking(self):
+        assert self.handshake.on_read_ready(1) # nothing received yet
+        assert self.handshake.registered_fileno in SelectService.selectibles
+        assert self.connection_manager.get_next_update_time(1) == 1 + CONTROLLERS_CONFIG.TLS_HANDSHAKE_TIMEOUT
+
+    def test_timeout(self):
+        self.connection_manager.update(1 + CONTROLLERS_CONFIG.TLS_HANDSHAKE_TIMEOUT)
+        assert self.connection_manager.handshakes == {}
+        assert self.handshake.registered_fileno not in SelectService.selectibles
+
+    def test_failed_handshake(self):
+        self.b.sendall(b"not a TLS client hello")
+        assert not self.handshake.on_read_ready(1)
+
+    def test_pending_handshakes_per_origin(self):
+        per_origin = CONTROLLERS_CONFIG.MAX_CONNECTIONS_PER_ORIGIN
+        assert self.connection_manager.get_num_handshakes("127.0.0.1") == 1
+        assert not self.manager.can_connect_from_origin("127.0.0.1", per_origin)
+        assert self.manager.can_connect_from_origin("127.0.0.1", per_origin - 1)
+        self.handshake.destroy_selectible()
+        self.handshake.destroy_selectible()
+        assert self.connection_manager.get_num_handshakes("127.0.0.1") == 0
+        assert self.connection_manager.handshakes_by_origin == {}
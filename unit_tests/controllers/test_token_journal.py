@@ -0,0 +1,80 @@
+from controllers.token_journal import TokenJournal
+from config.controllers_config import CONTROLLERS_CONFIG
+
+import os
+import json
+import shutil
+import tempfile
+
+def user(token, username="user"):
+    return {"token": token, "username": username, "token_type": 1}
+
+class TestTokenJournal(object):
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "tokens")
+        self.flush_interval = CONTROLLERS_CONFIG.TOKENS_JOURNAL_FLUSH_INTERVAL
+        CONTROLLERS_CONFIG.TOKENS_JOURNAL_FLUSH_INTERVAL = 0
+
+    def teardown_method(self, method):
+        CONTROLLERS_CONFIG.TOKENS_JOURNAL_FLUSH_INTERVAL = self.flush_interval
+        shutil.rmtree(self.directory)
+
+    def write_file(self, content):
+        with open(self.filename, "w") as F:
+            F.write(content)
+
+    def read_lines(self):
+        with open(self.filename, "r") as F:
+            return list(map(json.loads, F.read().splitlines()))
+
+    def test_append_and_load(self):
+        self.write_file("")
+        journal = TokenJournal(self.filename)
+        assert journal.load() == {}
+        journal.start()
+        journal.append(user("a"))
+        journal.append(user("b"))
+        journal.stop()
+        assert self.read_lines() == [user("a"), user("b")]
+        assert TokenJournal(self.filename).load() == {"a": user("a"), "b": user("b")}
+
+    def test_legacy_format(self):
+        self.write_file(json.dumps({"a": user("a"), "b": user("b")}, indent=4))
+        journal = TokenJournal(self.filename)
+        assert journal.load() == {"a": user("a"), "b": user("b")}
+        journal.start()
+        journal.append(user("c"))
+        journal.stop()
+        assert self.read_lines() == [user("a"), user("b"), user("c")] # rewritten as a journal
+
+    def test_interrupted_write(self):
+        self.write_file(json.dumps(user("a")) + "\n" + json.dumps(user("b"))[:10])
+        journal = TokenJournal(self.filename)
+        assert journal.load() == {"a": user("a")}
+        journal.start()
+        journal.stop()
+        assert self.read_lines() == [user("a")]
+
+    def test_interrupted_first_write(self):
+        self.write_file(json.dumps(user("a"))[:15])
+        journal = TokenJournal(self.filename)
+        assert journal.load() == {}
+        journal.start()
+        journal.append(user("b"))
+        journal.stop()
+        assert self.read_lines() == [user("b")]
+
+    def test_compaction(self):
+        max_stale_lines = CONTROLLERS_CONFIG.TOKENS_JOURNAL_MAX_STALE_LINES
+        CONTROLLERS_CONFIG.TOKENS_JOURNAL_MAX_STALE_LINES = 1
+        try:
+            self.write_file("")
+            journal = TokenJournal(self.filename)
+            journal.load()
+            journal.write([user("a", "1"), user("a", "2")])
+            assert len(self.read_lines()) == 2
+            journal.write([user("a", "3"), user("b")])
+            assert self.read_lines() == [user("a", "3"), user("b")]
+        finally:
+            CONTROLLERS_CONFIG.TOKENS_JOURNAL_MAX_STALE_LINES = max_stale_lines
@@ -0,0 +1,88 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from unit_tests.utilities.fake_objects import FakeThing
+from config.general_config import GENERAL_CONFIG
+from core.scheduler import ThingScheduler
+from core.select_service import SelectService
+
+import pytest
+
+class FakeUpdatedManager(object):
+    def __init__(self):
+        self.next_update_time = None
+        self.passes = [] # times at which it was updated
+        self.on_update = None # function called on every update (can be None)
+
+    def update(self, cur_time_s, handle_commands=True):
+        self.passes.append(cur_time_s)
+        if self.on_update:
+            self.on_update()
+
+    def get_next_update_time(self, cur_time_s):
+        return self.next_update_time
+
+    def cleanup(self):
+        pass
+
+class TestCoreLoop(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestCoreLoop, self).setup()
+        self.select_timeout = GENERAL_CONFIG.SELECT_TIMEOUT
+        GENERAL_CONFIG.SELECT_TIMEOUT = 1
+        # the core runs with fake managers (no sockets) and without Things to update
+        self.managers = (self.core.hw_manager, self.core.ctrl_manager)
+        self.core.hw_manager = FakeUpdatedManager()
+        self.core.ctrl_manager = FakeUpdatedManager()
+        self.core.thing_scheduler = ThingScheduler()
+
+    def teardown(self):
+        (self.core.hw_manager, self.core.ctrl_manager) = self.managers
+        GENERAL_CONFIG.SELECT_TIMEOUT = self.select_timeout
+        super(TestCoreLoop, self).teardown()
+
+    def test_timeout_clamped_to_timers(self):
+        self.core.hw_manager.next_update_time = 10.3
+        self.core.ctrl_manager.next_update_time = 10.5
+        self.core.update(10)
+        assert SelectService.select_timeout == pytest.approx(0.3)
+
+        self.core.thing_scheduler.schedule(FakeThing("timer"), 10.2)
+        self.core.update(10.1)
+        assert SelectService.select_timeout == pytest.approx(0.1)
+
+        self.core.hw_manager.next_update_time = self.core.ctrl_manager.next_update_time = None
+        self.core.thing_scheduler = ThingScheduler()
+        self.core.update(10.2)
+        assert SelectService.select_timeout == 1 # nothing pending: SELECT_TIMEOUT
+        self.core.hw_manager.next_update_time = 50
+        self.core.update(10.3)
+        assert SelectService.select_timeout == 1 # capped by SELECT_TIMEOUT
+
+    def test_idle_passes_skipped(self):
+        self.core.update(10)
+        hw_passes = len(self.core.hw_manager.passes)
+        skipped_passes = self.core.loop_stats.skipped_passes
+        self.core.update(10.5) # no input, timer or dirty Thing
+        assert len(self.core.hw_manager.passes) == hw_passes
+        assert self.core.loop_stats.skipped_passes == skipped_passes + 2
+
+        thing = FakeThing("thing")
+        self.core.thing_scheduler.schedule_now(thing)
+        self.core.update(10.6) # only the pass after the Thing updates runs
+        assert thing.updates == [10.6]
+        assert len(self.core.hw_manager.passes) == hw_passes + 1
+        assert self.core.loop_stats.skipped_passes == skipped_passes + 3
+
+        self.core.hw_manager.next_update_time = 10.7
+        self.core.update(10.6)
+        self.core.update(10.7) # timer due: both passes run
+        assert self.core.hw_manager.passes[-2:] == [10.7, 10.7]
+
+    def test_asap_forces_zero_timeout(self):
+        thing = FakeThing("thing")
+        self.core.ctrl_manager.on_update = lambda: self.core.thing_scheduler.schedule_now(thing) # e.g. a command changed a Thing
+        self.core.update(10)
+        assert self.core.thing_scheduler.get_next_deadline() == ThingScheduler.ASAP
+        assert SelectService.select_timeout == 0
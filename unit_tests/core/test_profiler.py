@@ -0,0 +1,24 @@
+from core.profiler import Histogram, Profiler
+
+class TestProfiler(object):
+    def setup_method(self, method):
+        Profiler.histograms = {}
+
+    def test_histogram_buckets(self):
+        histogram = Histogram()
+        for duration_s in [0.0002, 0.0002, 0.003, 10]:
+            histogram.record(duration_s)
+        report = histogram.to_json()
+        assert report["count"] == 4
+        assert report["buckets"] == {"<=0.25": 2, "<=5": 1, ">2500": 1}
+        assert report["p50_ms"] == 0.25
+        assert report["max_ms"] == 10000
+
+    def test_instrument(self):
+        class Thing(object):
+            def update(self, cur_time_s):
+                return cur_time_s * 2
+        thing = Thing()
+        Profiler.instrument(thing, ["update"], "thing.t")
+        assert thing.update(2) == 4
+        assert Profiler.get_report(prefix="thing.")["thing.t.update"]["count"] == 1
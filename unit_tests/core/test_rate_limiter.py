@@ -0,0 +1,25 @@
+from core.rate_limiter import TokenBucket
+
+class TestTokenBucket(object):
+    def test_burst_and_rate(self):
+        bucket = TokenBucket(100, 50)
+        assert bucket.get_available(0) == 50
+        bucket.consume(50, 0)
+        assert bucket.get_available(0) == 0
+        assert bucket.get_available(0.1) == 10
+        assert bucket.get_available(10) == 50 # never more than a burst
+
+    def test_available_time(self):
+        bucket = TokenBucket(100, 50)
+        assert bucket.get_available_time(20, 0) == 0
+        bucket.consume(50, 0)
+        assert abs(bucket.get_available_time(20, 0) - 0.2) < 1e-9
+        assert abs(bucket.get_available_time(500, 0) - 0.5) < 1e-9 # at most a burst is waited for
+
+    def test_throttling(self):
+        bucket = TokenBucket(100, 50)
+        bucket.consume(30, 0)
+        assert not bucket.is_throttling(0)
+        bucket.consume(20, 0)
+        assert bucket.is_throttling(0)
+        assert bucket.throttle_count == 1
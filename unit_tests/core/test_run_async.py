@@ -0,0 +1,55 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from config.controllers_config import CONTROLLERS_CONFIG
+
+import asyncio
+import struct
+import json
+
+class TestRunAsync(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        self.hosting_interfaces = CONTROLLERS_CONFIG.SOCKET_HOSTING_INTERCACES
+        CONTROLLERS_CONFIG.SOCKET_HOSTING_INTERCACES = ["lo"]
+        super(TestRunAsync, self).setup()
+
+    def teardown(self):
+        super(TestRunAsync, self).teardown()
+        CONTROLLERS_CONFIG.SOCKET_HOSTING_INTERCACES = self.hosting_interfaces
+
+    async def read_message(self, reader):
+        length = struct.unpack('<I', await asyncio.wait_for(reader.readexactly(4), 5))[0]
+        return json.loads((await asyncio.wait_for(reader.readexactly(length), 5)).decode("utf-8"))
+
+    async def run_client(self):
+        core_task = asyncio.ensure_future(self.core.run_async())
+        try:
+            while "lo" not in self.manager.connection_managers[0].server_socks:
+                await asyncio.sleep(0.01)
+            port = self.manager.connection_managers[0].server_socks["lo"].port
+            (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+            def send(command):
+                data = json.dumps(command).encode("utf-8")
+                writer.write(struct.pack('<I', len(data)) + data)
+
+            send({}) # authenticates (no tokens file)
+            await self.read_message(reader) # reply to the authentication
+            view = await self.read_message(reader)
+            assert view["lightswitch-d37"]["intensity"] == 0
+
+            send({"thing": "lightswitch-d37", "intensity": 1, "token": "t"})
+            assert await self.read_message(reader) == {"lightswitch-d37": {"intensity": 1, "token": "t"}}
+            writer.close()
+        finally:
+            core_task.cancel()
+            try:
+                await core_task
+            except asyncio.CancelledError: pass
+
+    def test_controller_round_trip(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run_client())
+        finally:
+            loop.close()
@@ -0,0 +1,48 @@
+from unit_tests.utilities.fake_objects import FakeThing
+from core.scheduler import ThingScheduler
+
+class TestThingScheduler(object):
+    def setup_method(self, method):
+        self.scheduler = ThingScheduler()
+
+    def test_only_due_things_update(self):
+        timer = FakeThing("timer", interval=5)
+        idle = FakeThing("idle")
+        self.scheduler.schedule_now(timer)
+        self.scheduler.schedule_now(idle)
+
+        self.scheduler.update_due_things(1)
+        assert timer.updates == [1] and idle.updates == [1]
+        assert self.scheduler.get_next_deadline() == 6
+
+        self.scheduler.update_due_things(3)
+        assert timer.updates == [1] and idle.updates == [1]
+
+        self.scheduler.update_due_things(6)
+        assert timer.updates == [1, 6] and idle.updates == [1]
+        assert self.scheduler.get_next_deadline() == 11
+
+    def test_earlier_deadline_wins(self):
+        thing = FakeThing("thing")
+        self.scheduler.schedule(thing, 10)
+        self.scheduler.schedule(thing, 20)
+        assert self.scheduler.get_next_deadline() == 10
+        self.scheduler.schedule_now(thing)
+        assert self.scheduler.get_next_deadline() == ThingScheduler.ASAP
+
+        self.scheduler.update_due_things(0)
+        assert thing.updates == [0]
+        assert self.scheduler.get_next_deadline() == None
+
+    def test_self_change_does_not_reschedule(self):
+        scheduler = self.scheduler
+        class SelfChangingThing(FakeThing):
+            def update(self, cur_time_s):
+                scheduler.schedule_now(self) # e.g. a Thing calling its own set_state()
+                return super(SelfChangingThing, self).update(cur_time_s)
+
+        thing = SelfChangingThing("thing")
+        scheduler.schedule_now(thing)
+        scheduler.update_due_things(1)
+        assert thing.updates == [1]
+        assert scheduler.get_next_deadline() == None
@@ -0,0 +1,75 @@
+from core.select_service import Selectible, SelectService
+
+import socket
+
+class SocketSelectible(Selectible):
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = bytearray([])
+        self.initialize_selectible_fd(sock)
+
+    def on_read_ready(self, cur_time_s):
+        read = self.sock.recv(1024)
+        self.received += read
+        return len(read) > 0
+
+class TestSelectService(object):
+    def setup_method(self, method):
+        (self.a, self.b) = socket.socketpair()
+        self.selectible = SocketSelectible(self.a)
+
+    def teardown_method(self, method):
+        self.selectible.destroy_selectible()
+        self.a.close()
+        self.b.close()
+
+    def test_write_interest(self):
+        fd = self.selectible.registered_fileno
+        assert fd not in SelectService.get_backend().write_selector.get_map()
+
+        self.selectible.write_to_fd(bytearray(b"hello"))
+        assert fd in SelectService.get_backend().write_selector.get_map()
+
+        SelectService.perform_select(0, select_reads=False)
+        assert self.b.recv(1024) == b"hello"
+        assert self.selectible.get_pending_write_size() == 0
+        assert fd not in SelectService.get_backend().write_selector.get_map()
+
+    def test_read_dispatch(self):
+        self.b.send(b"world")
+        SelectService.perform_select(0, select_writes=False)
+        assert self.selectible.received == bytearray(b"world")
+
+    def test_destroy_on_hangup(self):
+        fd = self.selectible.registered_fileno
+        self.b.close()
+        SelectService.perform_select(0, select_writes=False)
+        assert fd not in SelectService.selectibles
+        assert fd not in SelectService.get_backend().read_selector.get_map()
+
+    def test_partial_writes(self):
+        self.selectible.write_to_fd(b"abc")
+        self.selectible.write_to_fd(bytearray(b"defg"))
+        self.selectible.set_rate_limit(5, 5) # only 5 bytes can be sent now
+        self.selectible.on_write_ready(0)
+        assert self.b.recv(1024) == b"abcde"
+        assert self.selectible.get_pending_write_size() == 2
+        self.selectible.on_write_ready(2)
+        assert self.b.recv(1024) == b"fg"
+        assert len(self.selectible.pending_write_chunks) == 0
+
+    def test_throttled_writes(self):
+        fd = self.selectible.registered_fileno
+        self.selectible.set_rate_limit(10, 4)
+        self.selectible.write_to_fd(b"abcdefgh")
+        SelectService.perform_select(0, select_reads=False)
+        assert self.b.recv(1024) == b"abcd"
+        SelectService.perform_select(0, select_reads=False) # out of bytes
+        assert self.selectible.is_write_throttled()
+        assert fd not in SelectService.get_backend().write_selector.get_map()
+        assert self.selectible.get_next_write_time(0) == 0.4
+
+        SelectService.perform_select(0.4, select_reads=False) # resumed and written
+        assert self.b.recv(1024) == b"efgh"
+        assert not self.selectible.is_write_throttled()
+        assert self.selectible.get_next_write_time(0.4) == None
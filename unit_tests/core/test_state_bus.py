@@ -0,0 +1,62 @@
+from unit_tests.utilities.fake_objects import FakeThing
+from core.state_bus import StateBus
+
+class TestStateBus(object):
+    def setup_method(self, method):
+        self.bus = StateBus()
+        self.published = []
+        self.bus.subscribe(self.published.append)
+        self.things = [FakeThing("a"), FakeThing("b")]
+        for thing in self.things:
+            self.bus.mark_dirty(thing)
+        self.bus.flush()
+
+    def test_publishes_only_changes(self):
+        assert sorted(self.published[0]) == ["a", "b"]
+        assert self.bus.get_state("a") == {"intensity": 0, "token": ""}
+
+        (a, b) = self.things
+        a.intensity = 1
+        self.bus.mark_dirty(a)
+        self.bus.mark_dirty(b) # dirty but unchanged
+        assert self.bus.flush() == ["a"]
+        assert self.published[-1] == ["a"]
+        assert (a.state_version, b.state_version) == (2, 1)
+
+    def test_nothing_dirty(self):
+        assert self.bus.flush() == []
+        assert len(self.published) == 1
+
+    def test_thing_subscriptions(self):
+        (a, b) = self.things
+        changes = []
+        self.bus.subscribe(changes.append, thing_ids=["b"])
+        a.intensity = 1
+        b.intensity = 1
+        self.bus.mark_dirty(a)
+        self.bus.mark_dirty(b)
+        self.bus.flush()
+        assert changes == [["b"]]
+        assert sorted(self.published[-1]) == ["a", "b"]
+
+        self.bus.unsubscribe(changes.append)
+        b.intensity = 2
+        self.bus.mark_dirty(b)
+        self.bus.flush()
+        assert changes == [["b"]]
+        assert self.bus.thing_subscribers == {}
+
+    def test_changes_since_resume_token(self):
+        (a, b) = self.things
+        token = self.bus.get_resume_token()
+        a.intensity = 1
+        self.bus.mark_dirty(a)
+        self.bus.flush()
+        assert self.bus.get_changes_since(token) == set(["a"])
+        assert self.bus.get_changes_since(self.bus.get_resume_token()) == set()
+        assert self.bus.get_changes_since("0:0") == None # another run
+
+        old_token = "{}:0".format(self.bus.boot_id) # before the initial flush
+        assert self.bus.get_changes_since(old_token) == set(["a", "b"])
+        self.bus.change_log.popleft() # the log wrapped around
+        assert self.bus.get_changes_since(old_token) == None
@@ -0,0 +1,27 @@
+from unit_tests.utilities.base_framework import BaseTestFramework
+from core.scheduler import ThingScheduler
+
+class TestHotelPower(BaseTestFramework):
+    BLUEPRINT_FILENAME = "testing_utils/blueprints/hotel_lights.json"
+    DISABLE_HARDWARE = True
+
+    def setup(self):
+        super(TestHotelPower, self).setup()
+        self.hotel_controls = self.core.blueprint.get_thing("hotel-controls")
+        self.light = self.core.blueprint.get_thing("lightswitch-d37")
+
+    def test_things_stay_asleep_while_power_is_off(self):
+        self.light.set_state({"intensity": 1})
+        self.hotel_controls.set_hardware_state("d44", 0) # card removed
+        self.core.update(1)
+        timeout = self.hotel_controls.params.get("nocard_power_timeout")
+        self.core.update(2 + timeout)
+        assert self.hotel_controls.power == 0 and self.light.get_state()["intensity"] == 0
+
+        self.light.wake_up() # e.g. woken up by another Thing
+        assert self.light.get_state()["intensity"] == 1
+        self.core.update(3 + timeout)
+        assert self.light.get_state()["intensity"] == 0
+
+        self.core.update(4 + timeout)
+        assert self.core.thing_scheduler.get_next_deadline() != ThingScheduler.ASAP # not updated on every tick
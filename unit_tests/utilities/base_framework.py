@@ -1,3 +1,4 @@
+from config.general_config import GENERAL_CONFIG
 from config.hardware_config import HARDWARE_CONFIG
 from core.core import Core
 
@@ -7,16 +8,32 @@ class BaseTestFramework(object):
     current_fake_time = 0
     extra_update_calls = [] # Functions that will be called every update
     LEGACY_MODE = False
+    BLUEPRINT_FILENAME = None # Blueprint to load (None to keep GENERAL_CONFIG.BLUEPRINT_FILENAME)
+    DISABLE_HARDWARE = False # Whether or not to run the core without any hardware
+
+    # pytest only calls setup_method/teardown_method (not nose-style setup/teardown)
+    def setup_method(self, method):
+        self.setup()
+
+    def teardown_method(self, method):
+        self.teardown()
 
     def setup(self):
-        # Setup the system
+        # Setup the system (the config changed here is restored on teardown)
+        self.saved_config = (GENERAL_CONFIG.BLUEPRINT_FILENAME, HARDWARE_CONFIG.DISABLE_HARDWARE)
+        if self.BLUEPRINT_FILENAME != None:
+            GENERAL_CONFIG.BLUEPRINT_FILENAME = self.BLUEPRINT_FILENAME
+        if self.DISABLE_HARDWARE:
+            HARDWARE_CONFIG.DISABLE_HARDWARE = True
         HARDWARE_CONFIG.LEGACY_MODE = self.LEGACY_MODE
         self.core = Core()
+        self.manager = self.core.ctrl_manager
         self.extra_update_calls = [self.core.update]
 
     def teardown(self):
         self.core.cleanup()
         self.core = None
+        (GENERAL_CONFIG.BLUEPRINT_FILENAME, HARDWARE_CONFIG.DISABLE_HARDWARE) = self.saved_config
 
     def wait_for_condition(self, condition, attempts=100):
         count = 0
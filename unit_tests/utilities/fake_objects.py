@@ -0,0 +1,47 @@
+from core.state_bus import StateBus # the controllers package can only be imported after the core
+from controllers.encodings import JSONEncoding
+
+class FakeThing(object):
+    def __init__(self, id, interval=None):
+        self.id = id
+        self.interval = interval # time between updates (None if only updated when dirty)
+        self.updates = [] # times at which it was updated
+        self.intensity = 0
+        self.last_change_token = ""
+        self.state_version = 0
+
+    def update(self, cur_time_s):
+        self.updates.append(cur_time_s)
+        return False
+
+    def get_next_update_time(self, cur_time_s):
+        return cur_time_s + self.interval if self.interval else None
+
+    def get_state(self):
+        return {"intensity": self.intensity}
+
+class FakeCore(object):
+    def __init__(self):
+        self.state_bus = StateBus()
+
+class FakeManager(object):
+    def __init__(self):
+        self.core = FakeCore()
+        self.encodings = {"json": JSONEncoding()}
+
+    def register_controller(self, controller):
+        pass
+
+    def deregister_controller(self, controller):
+        pass
+
+# Stands for an authenticated controller when sending commands to the controllers manager
+class FakeSender(object):
+    def __init__(self):
+        self.authenticated_user = "user"
+        self.things_listening = None
+        self.sent = []
+
+    def send_data(self, json_data):
+        self.sent.append(json_data)
+        return True